@@ -1,13 +1,23 @@
 # GENERIC MAT ACCESS
+import time
+# loading this module (both sections) is reported as the 'import_app' stage
+_import_started = time.perf_counter(), time.process_time()
 from flask import Flask, render_template, request, jsonify
 import os
 import shutil
 from scripts.process_mat import process_mat_file
+from scripts.render import RENDER_PROFILES, PREVIEW_PROFILE
+from scripts.result_cache import (ResultCache, hash_file, RESULT_CACHE_FOLDER, RESULT_INDEX_FOLDER,
+                                  DEFAULT_CACHE_MAX_BYTES)
+from scripts.pipeline import process_mat_upload
 
 app = Flask(__name__)
 
 UPLOAD_FOLDER = 'uploads'
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+app.config['RESULT_CACHE_FOLDER'] = RESULT_CACHE_FOLDER
+app.config['RESULT_INDEX_FOLDER'] = RESULT_INDEX_FOLDER
+app.config['RESULT_CACHE_MAX_BYTES'] = DEFAULT_CACHE_MAX_BYTES
 
 @app.route('/')
 def index():
@@ -25,7 +35,14 @@ def upload_file():
     file_path = os.path.join(app.config['UPLOAD_FOLDER'], file.filename)
     file.save(file_path)
 
-    results = process_mat_file(file_path)
+    # every upload renders into its own content-derived folder under static/images
+    settings = {key: app.config[key] for key in ('RESULT_CACHE_FOLDER', 'RESULT_INDEX_FOLDER', 'RESULT_CACHE_MAX_BYTES')}
+    result_cache = ResultCache(settings['RESULT_CACHE_FOLDER'], settings['RESULT_CACHE_MAX_BYTES'],
+                               settings['RESULT_INDEX_FOLDER'])
+    cache_key = result_cache.make_key(hash_file(file_path), dict(RENDER_PROFILES[PREVIEW_PROFILE], pipeline='mat'))
+    results = result_cache.get(cache_key)
+    if results is None:
+        results = process_mat_upload(file_path, cache_key, settings)
     
     return render_template('results.html', results=results)
 
@@ -33,43 +50,435 @@ if __name__ == '__main__':
     app.run(host='0.0.0.0', port=8000, debug=True)
 
 # EBSSA FILE 
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, url_for, send_from_directory, g
+from werkzeug.utils import secure_filename
+import numpy as np
 import os
 import shutil
 from scripts.process_mat import process_mat_file
-from scripts.EBVisualizer import EVizTool, load_event_file
+from scripts.render import RENDER_PROFILES, PREVIEW_PROFILE, warm_up
+from scripts.event_stream import DEFAULT_CHUNK_SIZE, needs_streaming, is_event_store
+from scripts.result_cache import (ResultCache, RESULT_CACHE_FOLDER, RESULT_INDEX_FOLDER,
+                                  DEFAULT_CACHE_MAX_BYTES, REAPER_INTERVAL_SECONDS, STAGING_PREFIX)
+from scripts.job_queue import JobQueue, JOB_FOLDER
+from scripts.pipeline import process_event_upload, export_event_representations, export_event_playback
+from scripts.event_representations import (REPRESENTATION_KINDS, EXPORT_FORMATS, PLAYBACK_FORMATS,
+                                           DEFAULT_VOXEL_BINS, DEFAULT_TIME_SURFACE_TAU)
+from scripts.EBVisualizer import PLAYBACK_DECAY, PLAYBACK_FPS
+from scripts.instrumentation import stage, report_stage, metrics_text
+from scripts.upload_stream import StreamingUploadRequest, UploadRejected
+from werkzeug.exceptions import RequestEntityTooLarge
+from scripts.data_tiles import (MatVariable, list_mat_variables, event_count_images, count_image_layer, read_tile,
+                                decimate_minmax, pyramid_levels, DATA_CACHE_FOLDER, TILE_SIZE, MAX_SERIES_POINTS,
+                                COUNT_IMAGE_LAYERS)
 
 app = Flask(__name__)
+# uploads are hashed and checked while they stream to disk, see scripts.upload_stream
+app.request_class = StreamingUploadRequest
 
 UPLOAD_FOLDER = 'uploads'
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# larger request bodies are refused with 413 before they are read
+app.config['MAX_CONTENT_LENGTH'] = 8 * 1024 ** 3
+# event files above this size are aggregated chunk by chunk instead of loaded into memory
+app.config['EVENT_STREAM_THRESHOLD'] = 512 * 1024 * 1024
+app.config['EVENT_CHUNK_SIZE'] = DEFAULT_CHUNK_SIZE
+app.config['RESULT_CACHE_FOLDER'] = RESULT_CACHE_FOLDER
+app.config['RESULT_INDEX_FOLDER'] = RESULT_INDEX_FOLDER
+app.config['RESULT_CACHE_MAX_BYTES'] = DEFAULT_CACHE_MAX_BYTES
+app.config['RESULT_CACHE_REAPER_INTERVAL'] = REAPER_INTERVAL_SECONDS
+app.config['JOB_FOLDER'] = JOB_FOLDER
+app.config['DATA_CACHE_FOLDER'] = DATA_CACHE_FOLDER
+# worker processes rendering uploads, None uses one per CPU
+app.config['JOB_WORKERS'] = None
+# each job renders its figures in its own process, the jobs already run in parallel
+app.config['RENDER_WORKERS'] = 1
+# every job worker renders a throwaway figure (imports, font cache) before taking its first job
+app.config['WARM_UP_WORKERS'] = True
+# request arguments restricting event plots to a time range / region of interest
+EVENT_QUERY_ARGS = ('t0', 't1', 'roi')
+# request arguments noise filtering event plots: hot pixel sigmas and background activity window (seconds)
+EVENT_FILTER_ARGS = ('hot_pixels', 'ba_window')
+
+job_queue = JobQueue(app.config['JOB_FOLDER'], app.config['JOB_WORKERS'],
+                     initializer=warm_up if app.config['WARM_UP_WORKERS'] else None)
+# staging folders of renders are only reaped once their job has finished
+result_cache = ResultCache(app.config['RESULT_CACHE_FOLDER'], app.config['RESULT_CACHE_MAX_BYTES'],
+                           app.config['RESULT_INDEX_FOLDER'], is_active=job_queue.is_active)
+result_cache.start_reaper(app.config['RESULT_CACHE_REAPER_INTERVAL'])
+
+def pipeline_settings(profile=PREVIEW_PROFILE):
+    settings = {key: app.config[key] for key in ('EVENT_STREAM_THRESHOLD', 'EVENT_CHUNK_SIZE', 'RESULT_CACHE_FOLDER',
+                                                 'RESULT_CACHE_MAX_BYTES', 'RESULT_INDEX_FOLDER', 'RENDER_WORKERS')}
+    settings['RENDER_PROFILE'] = profile
+    return settings
+
+def save_upload(file):
+    """
+    # store an upload under uploads/<sha256>/<name>, so a queued job never reads another upload's bytes
+    the body was already written and hashed chunk by chunk while the request was parsed, only a rename is left
+    """
+    content_hash = file.stream.hexdigest()
+    upload_folder = os.path.join(app.config['UPLOAD_FOLDER'], content_hash)
+    os.makedirs(upload_folder, exist_ok=True)
+    extension = os.path.splitext(file.filename)[1]
+    file_name = secure_filename(file.filename) or 'upload' + extension
+    # same hash means same bytes: an earlier copy (read the same way, so with the same extension) is kept
+    existing = [name for name in os.listdir(upload_folder) if name.endswith(extension)]
+    file_path = os.path.join(upload_folder, existing[0] if existing else file_name)
+    file.stream.claim(file_path)
+    return file_path, content_hash
+
+def job_response(job_id, status_code, content_hash, query_args=None):
+    return jsonify({
+        'job_id': job_id,
+        'status_url': url_for('job_status', job_id=job_id),
+        # the upload hash (and time range / roi query) lets the results page offer full quality exports
+        'results_url': url_for('job_results', job_id=job_id, upload=content_hash, **(query_args or {})),
+        # full resolution data of the upload, served on demand for interactive zooming
+        'data_url': url_for('data_index', content_hash=content_hash),
+    }), status_code
+
+def find_upload(content_hash):
+    """Return the saved upload with this sha256, raising KeyError for unknown hashes."""
+    upload_folder = os.path.join(app.config['UPLOAD_FOLDER'], content_hash)
+    if len(content_hash) != 64 or not all(c in '0123456789abcdef' for c in content_hash) \
+            or not os.path.isdir(upload_folder) or not os.listdir(upload_folder):
+        raise KeyError(content_hash)
+    return os.path.join(upload_folder, os.listdir(upload_folder)[0])
+
+def event_store_folder(content_hash):
+    # columnar copy of an event upload, written by the first job that reads it
+    return os.path.join(app.config['DATA_CACHE_FOLDER'], content_hash, 'events')
+
+def event_query_args(values):
+    """
+    # time range / roi and noise filter arguments of a request, {} for none
+    t0, t1 in plot time units, roi=x0,y0,x1,y1, hot_pixels in standard deviations, ba_window in seconds
+    """
+    return {name: values[name] for name in EVENT_QUERY_ARGS + EVENT_FILTER_ARGS if values.get(name)}
+
+def parse_event_filter(query_args):
+    """Noise filter of process_event_upload, None without filter arguments, ValueError for malformed ones."""
+    if not any(name in query_args for name in EVENT_FILTER_ARGS):
+        return None
+    try:
+        hot_pixel_sigmas = float(query_args['hot_pixels']) if 'hot_pixels' in query_args else None
+        ba_window = float(query_args['ba_window']) if 'ba_window' in query_args else None
+    except ValueError:
+        raise ValueError("hot_pixels and ba_window must be numbers")
+    if (hot_pixel_sigmas is not None and hot_pixel_sigmas <= 0) or (ba_window is not None and ba_window <= 0):
+        raise ValueError("hot_pixels and ba_window must be positive")
+    return {'hot_pixel_sigmas': hot_pixel_sigmas, 'ba_window': ba_window}
+
+def parse_event_query(query_args, content_hash):
+    """EventIndex query of process_event_upload, raising ValueError for malformed arguments."""
+    if not any(name in query_args for name in EVENT_QUERY_ARGS):
+        return None
+    try:
+        t0 = float(query_args['t0']) if 't0' in query_args else None
+        t1 = float(query_args['t1']) if 't1' in query_args else None
+        roi = [int(value) for value in query_args['roi'].split(',')] if 'roi' in query_args else None
+    except ValueError:
+        raise ValueError("t0 and t1 must be numbers and roi four integers x0,y0,x1,y1")
+    if roi is not None and (len(roi) != 4 or roi[0] >= roi[2] or roi[1] >= roi[3]):
+        raise ValueError("roi must be x0,y0,x1,y1 with x0 < x1 and y0 < y1")
+    if t0 is not None and t1 is not None and t0 >= t1:
+        raise ValueError("t0 must be smaller than t1")
+    index_folder = os.path.join(app.config['DATA_CACHE_FOLDER'], content_hash, 'event_index')
+    return {'index_folder': index_folder, 't0': t0, 't1': t1, 'roi': roi}
+
+def array_response(array, **metadata):
+    # ?format=binary returns raw little-endian float32 samples, the shape travels in a header
+    if request.args.get('format') == 'binary':
+        response = app.response_class(np.ascontiguousarray(array, dtype='<f4').tobytes(),
+                                      mimetype='application/octet-stream')
+        response.headers['X-Array-Shape'] = ','.join(str(size) for size in array.shape)
+        return response
+    return jsonify(dict(metadata, shape=list(array.shape), data=array.tolist()))
+
+def preload_workers():
+    """
+    # optional startup hook, e.g. from a gunicorn post_fork / when_ready hook, run before traffic is accepted
+    starts (and so warms up) the job workers now instead of on the first upload
+    """
+    job_queue.start()
+
+# the first request of a process pays for every lazy import left, reported as the 'first_request' stage
+_first_request_pending = True
+
+@app.before_request
+def time_first_request():
+    if _first_request_pending:
+        g.request_started = time.perf_counter(), time.process_time()
+
+@app.after_request
+def report_first_request(response):
+    global _first_request_pending
+    if _first_request_pending and 'request_started' in g:
+        _first_request_pending = False
+        wall_start, cpu_start = g.request_started
+        report_stage('first_request', time.perf_counter() - wall_start, time.process_time() - cpu_start,
+                     path=request.path)
+    return response
+
+@app.after_request
+def immutable_result_images(response):
+    # images under a cache entry folder are content addressed, browsers may keep them forever
+    image_prefix = '/' + app.config['RESULT_CACHE_FOLDER'].strip('/') + '/'
+    if (request.path.startswith(image_prefix) and request.path.count('/') > image_prefix.count('/')
+            and STAGING_PREFIX not in request.path):
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
+@app.errorhandler(UploadRejected)
+@app.errorhandler(RequestEntityTooLarge)
+def upload_error(error):
+    return jsonify({'error': error.description}), error.code
+
 @app.route('/upload', methods=['POST'])
 def upload_file():
-    if 'file' not in request.files:
+    # parsing the form streams the file to disk, see scripts.upload_stream
+    with stage('receive_upload'):
+        files = request.files
+    if 'file' not in files:
         return jsonify({'error': 'No file uploaded'}), 400
 
     file = request.files['file']
     if file.filename == '' or not file.filename.endswith(('.mat', '.h5')):
         return jsonify({'error': 'Invalid file type. Please upload a .mat or .h5 file'}), 400
 
-    file_path = os.path.join(app.config['UPLOAD_FOLDER'], file.filename)
-    file.save(file_path)
+    file_path, content_hash = save_upload(file)
+    return render_upload(file_path, content_hash, PREVIEW_PROFILE, event_query_args(request.values))
+
+@app.route('/export/<content_hash>/<profile>', methods=['POST'])
+def export_upload(content_hash, profile):
+    # full quality renders are only made when asked for, and cached apart from the preview
+    if profile not in RENDER_PROFILES:
+        return jsonify({'error': f'Unknown render profile: {profile}'}), 400
+    try:
+        file_path = find_upload(content_hash)
+    except KeyError:
+        return jsonify({'error': 'Unknown upload'}), 404
+    return render_upload(file_path, content_hash, profile, event_query_args(request.values))
+
+@app.route('/replot/<content_hash>', methods=['POST'])
+def replot_upload(content_hash):
+    """
+    # plot a time range and / or roi of an event upload: ?t0=&t1= (plot time units), ?roi=x0,y0,x1,y1,
+    optionally noise filtered: ?hot_pixels= (standard deviations), ?ba_window= (seconds)
+    """
+    try:
+        file_path = find_upload(content_hash)
+    except KeyError:
+        return jsonify({'error': 'Unknown upload'}), 404
+    return render_upload(file_path, content_hash, request.values.get('profile', PREVIEW_PROFILE),
+                         event_query_args(request.values))
+
+def render_upload(file_path, content_hash, profile, query_args=None):
+    # identical recordings rendered with identical parameters are served from the cache
+    # streamed and in-memory renders draw the temporal density differently, so they are cached apart
+    try:
+        if profile not in RENDER_PROFILES:
+            raise ValueError(f'Unknown render profile: {profile}')
+        query = parse_event_query(query_args or {}, content_hash)
+        event_filter = parse_event_filter(query_args or {})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if query is not None:
+        # the queried events are held in memory, read through the recording's time / roi index
+        mode = 'query'
+    else:
+        mode = 'stream' if needs_streaming(file_path, app.config['EVENT_STREAM_THRESHOLD']) else 'memory'
+    params = dict(RENDER_PROFILES[profile], pipeline='events', mode=mode, profile=profile)
+    if query_args:
+        params['query'] = query_args
+    cache_key = result_cache.make_key(content_hash, params)
+    results = result_cache.get(cache_key)
+    if results is not None:
+        return job_response(job_queue.complete(results), 200, content_hash, query_args)
+
+    # parsing and plotting run in a worker process, the client polls the status url
+    job_id = job_queue.submit(process_event_upload, file_path, event_store_folder(content_hash), cache_key,
+                              pipeline_settings(profile), query, event_filter)
+    return job_response(job_id, 202, content_hash, query_args)
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = job_queue.status(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    # the full results list is only needed by the results page
+    return jsonify({key: value for key, value in job.items() if key != 'results'})
+
+@app.route('/results/<job_id>')
+def job_results(job_id):
+    job = job_queue.status(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    if job['state'] == 'error':
+        return jsonify({'error': job['error']}), 400
+    if job['state'] != 'done':
+        return jsonify({'state': job['state'], 'progress': job.get('progress')}), 202
+    # exports are offered when the page was reached from an upload response
+    content_hash = request.args.get('upload')
+    export_urls = {profile: url_for('export_upload', content_hash=content_hash, profile=profile,
+                                    **event_query_args(request.args))
+                   for profile in RENDER_PROFILES if profile != PREVIEW_PROFILE} if content_hash else {}
+    # ?timings=1 adds the per-stage timing table of the job (cache hits have none)
+    timings = job.get('timings') if request.args.get('timings') else None
+    return render_template('results.html', results=job['results'], export_urls=export_urls, timings=timings)
+
+@app.route('/metrics')
+def metrics():
+    # Prometheus text format: per-stage totals of uploads handled here and of finished jobs
+    return app.response_class(metrics_text(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/data/<content_hash>')
+def data_index(content_hash):
+    try:
+        file_path = find_upload(content_hash)
+        variables = list_mat_variables(file_path) if file_path.endswith('.mat') else []
+    except KeyError:
+        return jsonify({'error': 'Unknown upload'}), 404
+    data_url = url_for('data_index', content_hash=content_hash)
+    return jsonify({
+        'tile_size': TILE_SIZE,
+        # event recordings: /<layer>/<level>/<row>/<col> tiles of the per-pixel count images
+        'event_tiles_url': f"{data_url}/events",
+        'count_image_layers': list(COUNT_IMAGE_LAYERS),
+        # .mat variables: /series?start=&stop=&points= for 1D, /<level>/<row>/<col> tiles for 2D
+        'variables_url': f"{data_url}/variables",
+        'variables': variables,
+    })
+
+def event_count_images_for(content_hash):
+    file_path = find_upload(content_hash)
+    if is_event_store(event_store_folder(content_hash)):
+        file_path = event_store_folder(content_hash)
+    cache_path = os.path.join(app.config['DATA_CACHE_FOLDER'], content_hash, 'count_images.npy')
+    return event_count_images(file_path, cache_path, app.config['EVENT_CHUNK_SIZE'])
 
+@app.route('/data/<content_hash>/events/<layer>/<int:level>/<int:row>/<int:col>')
+def event_count_tile(content_hash, layer, level, row, col):
+    """Tile of the (x, y) event count image pyramid, rows run along x."""
     try:
-        event_name, event_df, sensor_dim = load_event_file(file_path)
-        eviz_obj = EVizTool(event_name, event_df, sensor_dim)
-        results = eviz_obj.visualize_event_data()
-    except KeyError as e:
+        count_images = event_count_images_for(content_hash)
+        tile = read_tile(count_image_layer(count_images, layer), count_images.shape[1:], level, row, col, 'sum')
+    except KeyError:
+        return jsonify({'error': 'Unknown upload'}), 404
+    except ValueError as e:
         return jsonify({'error': str(e)}), 400
+    return array_response(tile, level=level, row=row, col=col,
+                          levels=pyramid_levels(count_images.shape[1:]), full_shape=list(count_images.shape[1:]))
+
+@app.route('/data/<content_hash>/variables/<name>/series')
+def variable_series(content_hash, name):
+    """Min/max decimated viewport [start, stop) of a 1D variable."""
+    try:
+        with MatVariable(find_upload(content_hash), name) as variable:
+            length = variable.series_length()
+            start = max(0, request.args.get('start', 0, type=int))
+            stop = min(length, request.args.get('stop', length, type=int))
+            points = min(MAX_SERIES_POINTS, request.args.get('points', 1000, type=int))
+            if start >= stop or points < 1:
+                raise ValueError(f"Empty viewport [{start}, {stop}) with {points} points")
+            series = decimate_minmax(variable.read_series, start, stop, points)
+    except KeyError:
+        return jsonify({'error': f'Unknown upload or variable {name}'}), 404
     except ValueError as e:
         return jsonify({'error': str(e)}), 400
+    return jsonify(dict(series, start=start, stop=stop, length=length))
 
-    return render_template('results.html', results=results)
+@app.route('/data/<content_hash>/variables/<name>/<int:level>/<int:row>/<int:col>')
+def variable_tile(content_hash, name, level, row, col):
+    """Tile of a 2D variable's resolution pyramid, every sample is the mean of a 2**level block."""
+    try:
+        with MatVariable(find_upload(content_hash), name) as variable:
+            if len(variable.shape) != 2 or variable.ndim != 2:
+                raise ValueError(f"{name} is not 2D (shape={variable.shape})")
+            tile = read_tile(variable.read_window, variable.shape, level, row, col, 'mean')
+    except KeyError:
+        return jsonify({'error': f'Unknown upload or variable {name}'}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return array_response(tile, level=level, row=row, col=col,
+                          levels=pyramid_levels(variable.shape), full_shape=list(variable.shape))
+
+@app.route('/data/<content_hash>/representations/<kind>', methods=['POST'])
+def export_representation(content_hash, kind):
+    """
+    # queue a per-window event frame / time surface / voxel grid export of an event upload
+    window: ?time_window=<seconds> or ?event_count=<events>, optional ?bins=, ?tau=, ?format=h5|npz
+    """
+    export_format = request.values.get('format', 'h5')
+    try:
+        file_path = find_upload(content_hash)
+        if kind not in REPRESENTATION_KINDS or export_format not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown representation {kind} or format {export_format}")
+        if ('time_window' in request.values) == ('event_count' in request.values):
+            raise ValueError("Give exactly one of time_window and event_count")
+        if 'time_window' in request.values:
+            window = {'time_window': request.values.get('time_window', type=float)}
+        else:
+            window = {'event_count': request.values.get('event_count', type=int)}
+        params = {'n_bins': request.values.get('bins', DEFAULT_VOXEL_BINS, type=int),
+                  'tau': request.values.get('tau', DEFAULT_TIME_SURFACE_TAU, type=float)}
+        if None in window.values() or min(window.values()) <= 0 or params['n_bins'] < 1 or params['tau'] <= 0:
+            raise ValueError("time_window, event_count, bins and tau must be positive numbers")
+    except KeyError:
+        return jsonify({'error': 'Unknown upload'}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return queue_export(content_hash, file_path, f"{kind}.{export_format}", dict(window, **params), kind,
+                        export_event_representations, kind, window, params)
+
+@app.route('/data/<content_hash>/playback', methods=['POST'])
+def export_playback_video(content_hash):
+    """
+    # queue an animated playback of an event upload, one video frame per time window
+    ?time_window=<seconds>, optional ?decay= (0 - 1), ?fps=, ?format=mp4|gif
+    """
+    export_format = request.values.get('format', 'mp4')
+    try:
+        file_path = find_upload(content_hash)
+        if export_format not in PLAYBACK_FORMATS:
+            raise ValueError(f"Unknown playback format {export_format}")
+        time_window = request.values.get('time_window', type=float)
+        params = {'decay': request.values.get('decay', PLAYBACK_DECAY, type=float),
+                  'fps': request.values.get('fps', PLAYBACK_FPS, type=int)}
+        if time_window is None or time_window <= 0 or not 0 <= params['decay'] < 1 or params['fps'] < 1:
+            raise ValueError("time_window and fps must be positive numbers and decay in [0, 1)")
+    except KeyError:
+        return jsonify({'error': 'Unknown upload'}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return queue_export(content_hash, file_path, f"playback.{export_format}", dict(params, time_window=time_window),
+                        'Event playback', export_event_playback, time_window, params)
+
+def queue_export(content_hash, file_path, file_name, params, label, func, *args):
+    """Queue func(file_path, store_folder, output_path, download_url, *args), unless this export already exists."""
+    # the parameters are part of the file name, finished exports are served again without recomputing
+    name, extension = os.path.splitext(file_name)
+    file_name = f"{name}-{result_cache.make_key(content_hash, params)}{extension}"
+    output_path = os.path.join(app.config['DATA_CACHE_FOLDER'], content_hash, 'exports', file_name)
+    download_url = url_for('download_export', content_hash=content_hash, file_name=file_name)
+    if os.path.exists(output_path):
+        return job_response(job_queue.complete([{'variable': label, 'file': download_url}]), 200, content_hash)
+    job_id = job_queue.submit(func, file_path, event_store_folder(content_hash), output_path, download_url, *args)
+    return job_response(job_id, 202, content_hash)
+
+@app.route('/data/<content_hash>/exports/<file_name>')
+def download_export(content_hash, file_name):
+    folder = os.path.join(app.config['DATA_CACHE_FOLDER'], secure_filename(content_hash), 'exports')
+    return send_from_directory(folder, secure_filename(file_name), as_attachment=True)
+
+report_stage('import_app', time.perf_counter() - _import_started[0], time.process_time() - _import_started[1])
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=8000, debug=True)
@@ -1,167 +1,559 @@
 import os
 import scipy.io
 import h5py
-import cv2
 import numpy as np
-import pandas as pd
-import seaborn as sns
-import matplotlib.pyplot as plt
-from scipy.stats import gaussian_kde
+from scripts.render import PlotTask, render_results, load_seaborn, OUTPUT_FOLDER, RENDER_WORKERS, PREVIEW_PROFILE
+from scripts.instrumentation import stage, log_event
+from scripts.rasterize import draw_grid
+
+# compact per-column storage for event streams
+EVENT_COLUMN_DTYPES = {'t': np.int64, 'x': np.uint16, 'y': np.uint16, 'p': np.int8}
+# column layout of the (N, 4) "events" dataset in .h5 recordings
+H5_EVENT_COLUMNS = {'t': 0, 'x': 1, 'y': 2, 'p': 3}
+# "TD" struct field names in .mat recordings
+MAT_TD_FIELDS = {'t': 'ts', 'x': 'x', 'y': 'y', 'p': 'p'}
+# .mat (DAVIS / MATLAB) pixel coordinates start at 1
+MAT_COORDINATE_ORIGIN = 1
+# .h5 timestamps are in microseconds
+H5_TIME_SCALE = 1e-6
+# .mat timestamps are microseconds too, but their plots keep raw ticks (time_scale 1.0)
+MAT_TICK_SECONDS = 1e-6
+# rows per h5py read when the dataset cannot be memory mapped
+H5_READ_CHUNK_ROWS = 1 << 20
+# kernel density settings, mirroring the seaborn.kdeplot defaults (Scott's rule, cut=3, 200 grid points)
+KDE_CUT = 3
+KDE_GRIDSIZE = 200
+# gaussian kernel is truncated this many bandwidths away from its centre
+KDE_KERNEL_TRUNCATE = 5
+# resolution of the time histogram the temporal density is estimated from
+TIME_BINS = 1 << 14
+# the exact (seaborn) kernel density is only drawn on request, and only up to this many events per polarity
+EXACT_KDE_MAX_EVENTS = 100000
+# events handed to the representation builder at a time
+EVENT_WINDOW_CHUNK = 1 << 20
+# event playback: video frame rate, share of the previous frame kept per window, events saturating a pixel
+PLAYBACK_FPS = 20
+PLAYBACK_DECAY = 0.8
+PLAYBACK_GAIN = 2.0
+# small sensors are scaled up by a whole factor to at least this width
+PLAYBACK_MIN_WIDTH = 512
+# GIF frames are kept in memory until encoded, longer playbacks have to be MP4
+MAX_GIF_FRAMES = 600
+
+class EventColumns:
+    def __init__(self, t, x, y, p, time_scale=1.0):
+        """
+        # column-oriented view of an event stream, indexable like a data frame (events["t"])
+        :param t: integer timestamps in file ticks
+        :param x: x pixel coordinates
+        :param y: y pixel coordinates
+        :param p: polarities
+        :param time_scale: float - seconds per timestamp tick
+        """
+        self.t = t
+        self.x = x
+        self.y = y
+        self.p = p
+        self.time_scale = time_scale
+
+    def __getitem__(self, column):
+        return getattr(self, column)
+
+    def __len__(self):
+        return len(self.t)
+
+    def slice(self, start, stop):
+        """Events [start, stop) as EventColumns sharing this stream's arrays."""
+        return EventColumns(self.t[start:stop], self.x[start:stop], self.y[start:stop], self.p[start:stop],
+                            time_scale=self.time_scale)
+
+def seconds_per_tick(source_name, time_scale):
+    """
+    # real duration of one timestamp tick, for windows given in seconds whatever the plots' time unit
+    :param source_name: string - recording file name, .mat timestamps are microseconds
+    :param time_scale: float - plot time units per tick of the loaded events
+    """
+    return MAT_TICK_SECONDS if str(source_name).endswith('.mat') else time_scale
+
+def grow_count_images(counts, shape):
+    """Zero-pad (2, X, Y) count images so they cover at least shape=(X, Y)."""
+    x_size, y_size = max(counts.shape[1], shape[0]), max(counts.shape[2], shape[1])
+    if (x_size, y_size) == counts.shape[1:]:
+        return counts
+    grown = np.zeros((2, x_size, y_size), dtype=counts.dtype)
+    grown[:, :counts.shape[1], :counts.shape[2]] = counts
+    return grown
+
+def accumulate_polarity_counts(x, y, p, sensor_size, out=None):
+    """
+    # build per-polarity event count images in a single vectorized pass
+    :param x: array of x pixel coordinates
+    :param y: array of y pixel coordinates
+    :param p: array of polarities (ON > 0, OFF <= 0)
+    :param sensor_size: tuple - (x_max, y_max), the minimum image size
+    :param out: optional int64 array of shape (2, X, Y) to add the counts into
+    :return: int64 array of shape (2, X, Y) - index 0 OFF counts, index 1 ON counts. The images grow past
+             sensor_size to cover every observed coordinate (DAVIS .mat captures are 1-based, so x == xMax
+             occurs), callers must use the returned array rather than out.
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    p = np.asarray(p)
+    # negative coordinates cannot be indexed and are dropped
+    if x.dtype.kind == 'i' or y.dtype.kind == 'i':
+        valid = (x >= 0) & (y >= 0)
+        if not valid.all():
+            x, y, p = x[valid], y[valid], p[valid]
+
+    shape = (int(sensor_size[0]), int(sensor_size[1]))
+    if len(x):
+        shape = (max(shape[0], int(x.max()) + 1), max(shape[1], int(y.max()) + 1))
+    out = grow_count_images(np.zeros((2, 0, 0), dtype=np.int64) if out is None else out, shape)
+    x_max, y_max = out.shape[1], out.shape[2]
+
+    # linearized (polarity, x, y) index -> one bincount for both polarities
+    polarity_index = (p > 0).astype(np.int64)
+    linear_index = (polarity_index * x_max + x.astype(np.int64)) * y_max + y.astype(np.int64)
+    out += np.bincount(linear_index, minlength=2 * x_max * y_max).reshape(2, x_max, y_max)
+    return out
+
+def linear_binning(values, grid_min, bin_width, n_bins, out=None):
+    """
+    # spread each value linearly over its two neighbouring grid points (mass preserving)
+    :param values: 1D array of samples inside [grid_min, grid_min + (n_bins - 1) * bin_width]
+    :param grid_min: float - position of the first grid point
+    :param bin_width: float - grid spacing
+    :param n_bins: int - number of grid points (at least 2)
+    :param out: optional float64 array of length n_bins to add the weights into
+    :return: float64 array of length n_bins
+    """
+    if out is None:
+        out = np.zeros(n_bins, dtype=np.float64)
+    position = (np.asarray(values, dtype=np.float64) - grid_min) / bin_width
+    position = np.clip(position, 0, n_bins - 1)
+    left = np.minimum(position.astype(np.int64), n_bins - 2)
+    right_weight = position - left
+    out += np.bincount(left, weights=1.0 - right_weight, minlength=n_bins)
+    out += np.bincount(left + 1, weights=right_weight, minlength=n_bins)
+    return out
+
+def binned_gaussian_kde(binned, grid_min, bin_width, count, std, data_min, data_max):
+    """
+    # gaussian kernel density from linearly binned samples, evaluated on the seaborn support grid
+    :param binned: float64 array of bin weights from linear_binning
+    :param grid_min: float - position of the first bin
+    :param bin_width: float - bin spacing
+    :param count: int - number of samples
+    :param std: float - sample standard deviation (ddof=1)
+    :param data_min: float - smallest sample
+    :param data_max: float - largest sample
+    :return: (support, density) arrays of length KDE_GRIDSIZE
+    """
+    # Scott's rule, as used by scipy.stats.gaussian_kde for 1D data
+    bandwidth = std * count ** (-1.0 / 5)
+    support = np.linspace(data_min - KDE_CUT * bandwidth, data_max + KDE_CUT * bandwidth, KDE_GRIDSIZE)
+    if bandwidth <= 0:
+        return support, np.zeros(KDE_GRIDSIZE)
+
+    # pad the bins far enough that the support grid and the kernel tails fit
+    kernel_half_width = int(np.ceil(KDE_KERNEL_TRUNCATE * bandwidth / bin_width))
+    pad = int(np.ceil(KDE_CUT * bandwidth / bin_width)) + 1
+    padded = np.concatenate([np.zeros(pad), binned, np.zeros(pad)])
+    offsets = np.arange(-kernel_half_width, kernel_half_width + 1) * bin_width
+    kernel = np.exp(-0.5 * (offsets / bandwidth) ** 2)
+    kernel /= kernel.sum() * bin_width
+
+    # linear convolution through the FFT
+    n_fft = len(padded) + len(kernel) - 1
+    smoothed = np.fft.irfft(np.fft.rfft(padded, n_fft) * np.fft.rfft(kernel, n_fft), n_fft)
+    smoothed = smoothed[kernel_half_width:kernel_half_width + len(padded)] / count
+
+    grid = grid_min + (np.arange(len(padded)) - pad) * bin_width
+    density = np.clip(np.interp(support, grid, smoothed), 0, None)
+    return support, density
+
+def estimate_temporal_density(t, time_scale=1.0, n_bins=TIME_BINS):
+    """
+    # binned gaussian kernel density of one polarity's timestamps, same bandwidth as seaborn.kdeplot
+    :param t: 1D array of at least 2 timestamps in file ticks
+    :param time_scale: float - seconds per timestamp tick
+    :param n_bins: int - number of time grid points
+    :return: (support_seconds, density_per_second) arrays of length KDE_GRIDSIZE
+    """
+    t = np.asarray(t, dtype=np.float64)
+    t_min, t_max = t.min(), t.max()
+    bin_width = (t_max - t_min) / (n_bins - 1) or 1.0
+    binned = linear_binning(t, t_min, bin_width, n_bins)
+    support, density = binned_gaussian_kde(binned, t_min, bin_width, len(t), t.std(ddof=1), t_min, t_max)
+    return support * time_scale, density / time_scale
 
 class EVizTool:
-    def __init__(self, event_file_name, event_data_frame, sensor_size):
+    def __init__(self, event_file_name, event_data, sensor_size):
         """
         # initialization of EVizToll class containing custom methods for data visualisation
         :param event_file_name: string - "dvs_test.mat" or "dvs_test.h5"
-        :param event_data_frame: pandas data frame containing event based data - t, x, y, p (0 / 1)
+        :param event_data: EventColumns from load_event_file or a pandas data frame - t, x, y, p (0 / 1)
         :param sensor_size: tuple
         """
         self.event_file_name = event_file_name
-        self.event_data_frame = event_data_frame
-        self.t = event_data_frame["t"].values
-        self.x = event_data_frame["x"].values
-        self.y = event_data_frame["y"].values
-        self.p = event_data_frame["p"].values
-        self.sensor_size = sensor_size
-        print(self.event_file_name, len(self.t),len(self.x),len(self.y),len(self.p),
-        self.event_data_frame,
-        self.t,
-        self.x,
-        self.y,
-        self.p,
-        self.sensor_size)
-        # making OFF polarity convention to always 0
-        self.p[self.p == -1] = 0
+        self.event_data = event_data
+        if event_data is not None:
+            self.t = np.asarray(event_data["t"])
+            self.x = np.asarray(event_data["x"])
+            self.y = np.asarray(event_data["y"])
+            # making OFF polarity convention to always 0 (without writing into the loaded column)
+            p = np.asarray(event_data["p"])
+            self.p = np.where(p == -1, 0, p).astype(np.int8, copy=False)
+            log_event('events_loaded', file=self.event_file_name, events=len(self.t), sensor_size=sensor_size)
+        else:
+            # streamed recordings only carry the aggregates set by from_accumulator
+            self.t = self.x = self.y = self.p = None
+        # seconds per timestamp tick, data frames are assumed to already be in plot units
+        self.time_scale = getattr(event_data, 'time_scale', 1.0)
         self.sensor_size = sensor_size
         self.sensor_x_max, self.sensor_y_max = sensor_size[0], sensor_size[1]
-        
+        # per-polarity aggregates, built lazily once and shared by every plot that needs them
+        self._polarity_count_images = None
+        self._polarity_totals = None
+        self._temporal_density = None
+        # EventFilter.report() of the noise filter the events went through, None when unfiltered
+        self.filter_report = None
+
+    @classmethod
+    def from_accumulator(cls, event_file_name, accumulator):
+        """Build a visualizer from a streamed EventAccumulator instead of in-memory event columns."""
+        eviz_obj = cls(event_file_name, None, accumulator.sensor_size)
+        eviz_obj.time_scale = accumulator.time_scale
+        eviz_obj._polarity_count_images = accumulator.count_images
+        eviz_obj._polarity_totals = accumulator.polarity_totals
+        eviz_obj._temporal_density = accumulator.temporal_density()
+        return eviz_obj
+
+    def get_polarity_count_images(self):
+        """Return (OFF, ON) event count images of shape sensor_size, computed once per instance."""
+        if self._polarity_count_images is None:
+            with stage('count_images'):
+                self._polarity_count_images = accumulate_polarity_counts(self.x, self.y, self.p, self.sensor_size)
+        return self._polarity_count_images
+
+    def get_polarity_totals(self):
+        """Return the number of [OFF, ON] events in the whole recording."""
+        if self._polarity_totals is None:
+            self._polarity_totals = np.bincount(self.p, minlength=2)[:2]
+        return self._polarity_totals
+
+    def get_temporal_density(self):
+        """Return {polarity: (support_seconds, density_per_second)} for every polarity with 2+ events."""
+        if self._temporal_density is None:
+            self._temporal_density = {}
+            with stage('temporal_density'):
+                for polarity in (0, 1):
+                    t = self.t[self.p == polarity]
+                    if len(t) >= 2:
+                        self._temporal_density[polarity] = estimate_temporal_density(t, self.time_scale)
+        return self._temporal_density
+
+    def plot_task(self, filename, draw, args, figsize):
+        return PlotTask(filename, draw, args, figsize)
+
     def plot_event_histogram(self):
-        plt.figure(figsize=(10, 5))
-        plt.hist(self.p, bins=3, edgecolor="black", alpha=0.7)
-        plt.title(f'Event Polarity Histogram - {self.event_file_name}')
-        # plt.xticks([1, -1], labels=["ON (1)", "OFF (-1)"])
-        plt.ylabel("Count")
-
-    def plot_temporal_kernel_density(self):
-        plt.figure(figsize=(10, 5))
-        sns.kdeplot(self.t[self.p == 1], label="ON Events", fill=True, cmap="Blues")
-        sns.kdeplot(self.t[self.p == 0], label="OFF Events", fill=True, cmap="Reds")
-        plt.title(f'Temporal Kernel Density Visualization - {self.event_file_name}')
-        plt.xlabel("Time")
-        plt.ylabel("Density")
-        plt.legend()
-        plt.tight_layout()
+        return self.plot_task('event_histogram', draw_event_histogram,
+                              (self.event_file_name, self.get_polarity_totals()), (10, 5))
+
+    def plot_temporal_kernel_density(self, exact=False):
+        """
+        # temporal density of ON and OFF events, binned and FFT smoothed in near linear time
+        :param exact: bool - draw the exact seaborn kernel density instead, only honoured for in-memory
+                      recordings with at most EXACT_KDE_MAX_EVENTS events per polarity
+        """
+        if exact and self.t is not None and max(self.get_polarity_totals()) <= EXACT_KDE_MAX_EVENTS:
+            t_on, t_off = self.t[self.p == 1] * self.time_scale, self.t[self.p == 0] * self.time_scale
+            return self.plot_task('temporal_kernel_density', draw_temporal_kernel_density,
+                                  (self.event_file_name, t_on, t_off), (10, 5))
+        return self.plot_task('temporal_kernel_density', draw_binned_temporal_density,
+                              (self.event_file_name, self.get_temporal_density()), (10, 5))
 
     def plot_event_on_off_map(self):
-        x_on, y_on = self.x[self.p == 1], self.y[self.p == 1]
-        x_off, y_off = self.x[self.p == 0], self.y[self.p == 0]
-        fig1, ax = plt.subplots(1, 2, figsize=(12, 5))
-        # map for ON events
-        hb1 = ax[0].hexbin(x_on, y_on, gridsize=50, cmap="Blues", mincnt=1)
-        ax[0].set_title(f"ON Events Density - {self.event_file_name}")
-        ax[0].set_xlabel("X Coordinate")
-        ax[0].set_ylabel("Y Coordinate")
-        plt.colorbar(hb1, ax=ax[0])
-
-        # map for OFF events
-        hb2 = ax[1].hexbin(x_off, y_off, gridsize=50, cmap="Reds", mincnt=1)
-        ax[1].set_title(f"OFF Events Density - {self.event_file_name}")
-        ax[1].set_xlabel("X Coordinate")
-        plt.colorbar(hb2, ax=ax[1])
-        plt.tight_layout()
+        counts_off, counts_on = self.get_polarity_count_images()
+        return self.plot_task('event_on_off_map', draw_event_on_off_map,
+                              (self.event_file_name, counts_on, counts_off), (12, 5))
 
     def plot_polarity_count_at_given_pixel(self):
-        polarity_counts = self.event_data_frame.groupby(['x', 'y'])['p'].value_counts().unstack(fill_value=0)
-        polarity_counts.columns = ['p=0', 'p=1']
-        polarity_counts['intensity'] = 255 * (polarity_counts['p=1'] - polarity_counts['p=0'])
-        max_pixel = polarity_counts.sum(axis=1).idxmax()
-        min_pixel = polarity_counts.sum(axis=1).idxmin()
-
-        selected_pixels = [max_pixel, min_pixel]
-        # selected_pixels = [(0, 32), (0, 34), (0, 36), (117, 68)]
-
-        fig, axes = plt.subplots(1, len(selected_pixels), figsize=(15, 4))
-
-        for ax, (x, y) in zip(axes, selected_pixels):
-            if (x, y) in polarity_counts.index:
-                data = polarity_counts.loc[(x, y)]
-                ax.bar(['p=0', 'p=1'], [data['p=0'], data['p=1']], color=['red', 'blue'])
-                ax.set_title(f'Pixel ({x},{y})')
-                ax.set_ylabel('Count')
-            else:
-                ax.set_title(f'Pixel ({x},{y}) - No Events')
-                ax.bar(['p=0', 'p=1'], [0, 0], color=['red', 'blue'])
-
-        plt.tight_layout()
+        counts_off, counts_on = self.get_polarity_count_images()
+        return self.plot_task('polarity_count', draw_polarity_count_at_given_pixel,
+                              (counts_off, counts_on), (15, 4))
 
     def plot_event_intensity_map(self):
-        polarity_counts = self.event_data_frame.groupby(['x', 'y'])['p'].value_counts().unstack(fill_value=0)
-        polarity_counts.columns = ['p=0', 'p=1']
-
-        polarity_counts['intensity'] = 255 * (polarity_counts['p=1'] - polarity_counts['p=0'])
-        intensity_map = np.zeros(self.sensor_size)
-        for (x, y), row in polarity_counts.iterrows():
-            if 0 <= x < self.sensor_size[0] and 0 <= y < self.sensor_size[1]:
-                intensity_map[x, y] = row['intensity']
-
-        plt.figure(figsize=(8, 6))
-        plt.imshow(intensity_map.T, cmap='seismic_r', origin='upper', interpolation='nearest')
-        plt.colorbar(label="Net Intensity Change")
-        plt.title(f"Event Intensity Map - {self.event_file_name}")
-        plt.xlabel("X Pixel")
-        plt.ylabel("Y Pixel")
-        plt.tight_layout()
-
-    def save_plot(self, filename):
-        filepath = os.path.join('static/images', f"{filename}.png")
-        plt.savefig(filepath, dpi=300)
-        plt.close()
-        return f"/{filepath}"
+        counts_off, counts_on = self.get_polarity_count_images()
+        return self.plot_task('event_intensity_map', draw_event_intensity_map,
+                              (self.event_file_name, counts_off, counts_on, self.sensor_size), (8, 6))
 
-    def visualize_event_data(self):
-        results = []
-
-        self.plot_event_histogram()
-        results.append({'variable': 'Event Time Histogram', 'file': self.save_plot('event_histogram')})
-
-        self.plot_temporal_kernel_density()
-        results.append({'variable': 'Temporal Kernel Density', 'file': self.save_plot('temporal_kernel_density')})
-
-        self.plot_event_on_off_map()
-        results.append({'variable': 'Event ON/OFF Map', 'file': self.save_plot('event_on_off_map')})
-
-        self.plot_polarity_count_at_given_pixel()
-        results.append({'variable': 'Polarity Count at Given Pixel', 'file': self.save_plot('polarity_count')})
-
-        self.plot_event_intensity_map()
-        results.append({'variable': 'Event Intensity Map', 'file': self.save_plot('event_intensity_map')})
+    def iter_representations(self, kind, time_window=None, event_count=None, chunk_size=EVENT_WINDOW_CHUNK, **params):
+        """
+        # per-window event frames, time surfaces or voxel grids of the in-memory events
+        :param kind: string - 'frame', 'time_surface' or 'voxel_grid', see RepresentationBuilder
+        :param time_window: float - fixed-interval windows, in seconds
+        :param event_count: int - fixed-count windows
+        :param params: n_bins / tau, see RepresentationBuilder
+        :return: generator of (window_index, t_start, t_stop, tensor), timestamps in ticks
+        """
+        # imported here, event_representations builds on this module
+        from scripts.event_representations import RepresentationBuilder, iter_representations
+        if self.t is None:
+            raise ValueError("Streamed recordings keep no events, use export_representations on the file")
+        t, x, y, p = self.t, self.x, self.y, self.p
+        if len(t) and np.any(t[1:] < t[:-1]):
+            order = np.argsort(t, kind='stable')
+            t, x, y, p = t[order], x[order], y[order], p[order]
+        events = EventColumns(t, x, y, p, time_scale=self.time_scale)
+        origin = MAT_COORDINATE_ORIGIN if str(self.event_file_name).endswith('.mat') else 0
+        builder = RepresentationBuilder(kind, self.sensor_size, origin, time_scale=self.time_scale,
+                                        tick_seconds=seconds_per_tick(self.event_file_name, self.time_scale), **params)
+        chunks = (events.slice(start, start + chunk_size) for start in range(0, len(events), chunk_size))
+        t_origin = int(t[0]) if len(t) else 0
+        return iter_representations(chunks, t_origin, builder, time_window, event_count)
+
+    def render_playback(self, output_path, time_window, decay=PLAYBACK_DECAY, fps=PLAYBACK_FPS):
+        """
+        # animate the in-memory events window by window into an MP4 or GIF, see write_playback
+        :param time_window: float - time covered by one video frame, in seconds
+        :return: number of frames written
+        """
+        windows = self.iter_representations('frame', time_window=time_window)
+        return write_playback(windows, output_path, self.time_scale, decay, fps)
 
-        return results
+    def visualize_event_data(self, progress=None, max_workers=RENDER_WORKERS, output_folder=OUTPUT_FOLDER,
+                             exact_kde=False, profile=PREVIEW_PROFILE):
+        """
+        # render every event plot, figures are drawn in parallel worker processes
+        :param output_folder: string - folder the images are written to
+        :param progress: optional callable(done, total, current) called as each plot finishes
+        :param max_workers: int - render processes, 1 renders in this process
+        :param exact_kde: bool - see plot_temporal_kernel_density
+        :param profile: string - render profile, see scripts.render.RENDER_PROFILES
+        :return: list of {'variable', 'file'} results, always in the same order
+        """
+        results = [
+            {'variable': 'Event Time Histogram', 'file': self.plot_event_histogram()},
+            {'variable': 'Temporal Kernel Density', 'file': self.plot_temporal_kernel_density(exact_kde)},
+            {'variable': 'Event ON/OFF Map', 'file': self.plot_event_on_off_map()},
+            {'variable': 'Polarity Count at Given Pixel', 'file': self.plot_polarity_count_at_given_pixel()},
+            {'variable': 'Event Intensity Map', 'file': self.plot_event_intensity_map()},
+        ]
+        if self.filter_report is not None:
+            results.insert(0, {'variable': 'Event Filter', 'file': '', 'value': self.filter_report['summary']})
+        return render_results(results, output_folder, max_workers, progress, profile)
+
+def draw_event_histogram(fig, event_file_name, polarity_totals):
+    # same bars as a histogram over every polarity value, drawn from the two totals
+    present = np.flatnonzero(polarity_totals)
+    ax = fig.subplots()
+    ax.hist(present, bins=3, weights=polarity_totals[present], edgecolor="black", alpha=0.7)
+    ax.set_title(f'Event Polarity Histogram - {event_file_name}')
+    # ax.set_xticks([1, -1], labels=["ON (1)", "OFF (-1)"])
+    ax.set_ylabel("Count")
+
+def _label_temporal_density(fig, ax, event_file_name):
+    ax.set_title(f'Temporal Kernel Density Visualization - {event_file_name}')
+    ax.set_xlabel("Time")
+    ax.set_ylabel("Density")
+    ax.legend()
+    fig.tight_layout()
+
+def draw_temporal_kernel_density(fig, event_file_name, t_on, t_off):
+    ax = fig.subplots()
+    sns = load_seaborn()
+    sns.kdeplot(t_on, label="ON Events", fill=True, cmap="Blues", ax=ax)
+    sns.kdeplot(t_off, label="OFF Events", fill=True, cmap="Reds", ax=ax)
+    _label_temporal_density(fig, ax, event_file_name)
+
+def draw_binned_temporal_density(fig, event_file_name, densities):
+    ax = fig.subplots()
+    for polarity, label, color in ((1, "ON Events", "C0"), (0, "OFF Events", "C1")):
+        if polarity in densities:
+            support, density = densities[polarity]
+            ax.plot(support, density, color=color, label=label)
+            ax.fill_between(support, density, color=color, alpha=0.25)
+    _label_temporal_density(fig, ax, event_file_name)
+
+def _draw_counts(ax, counts, cmap):
+    # the count image already is the aggregated grid, one cell per pixel whatever the number of events
+    return draw_grid(ax, counts, (-0.5, counts.shape[0] - 0.5, -0.5, counts.shape[1] - 0.5), cmap, log=True)
+
+def draw_event_on_off_map(fig, event_file_name, counts_on, counts_off):
+    ax = fig.subplots(1, 2)
+    # map for ON events
+    im1 = _draw_counts(ax[0], counts_on, "Blues")
+    ax[0].set_title(f"ON Events Density - {event_file_name}")
+    ax[0].set_xlabel("X Coordinate")
+    ax[0].set_ylabel("Y Coordinate")
+    fig.colorbar(im1, ax=ax[0])
+
+    # map for OFF events
+    im2 = _draw_counts(ax[1], counts_off, "Reds")
+    ax[1].set_title(f"OFF Events Density - {event_file_name}")
+    ax[1].set_xlabel("X Coordinate")
+    fig.colorbar(im2, ax=ax[1])
+    fig.tight_layout()
+
+def draw_polarity_count_at_given_pixel(fig, counts_off, counts_on):
+    total_counts = counts_off + counts_on
+    active_pixels = np.flatnonzero(total_counts)
+
+    if active_pixels.size:
+        flat_totals = total_counts.ravel()[active_pixels]
+        max_pixel = np.unravel_index(active_pixels[np.argmax(flat_totals)], total_counts.shape)
+        min_pixel = np.unravel_index(active_pixels[np.argmin(flat_totals)], total_counts.shape)
+        selected_pixels = [max_pixel, min_pixel]
+    else:
+        selected_pixels = []
+    # selected_pixels = [(0, 32), (0, 34), (0, 36), (117, 68)]
+
+    axes = fig.subplots(1, max(len(selected_pixels), 1), squeeze=False)
+
+    for ax, (x, y) in zip(axes[0], selected_pixels):
+        if total_counts[x, y] > 0:
+            ax.bar(['p=0', 'p=1'], [counts_off[x, y], counts_on[x, y]], color=['red', 'blue'])
+            ax.set_title(f'Pixel ({x},{y})')
+            ax.set_ylabel('Count')
+        else:
+            ax.set_title(f'Pixel ({x},{y}) - No Events')
+            ax.bar(['p=0', 'p=1'], [0, 0], color=['red', 'blue'])
+
+    fig.tight_layout()
+
+def draw_event_intensity_map(fig, event_file_name, counts_off, counts_on, sensor_size):
+    # the intensity map only shows the sensor area, events past xMax / yMax are left out
+    x_max, y_max = int(sensor_size[0]), int(sensor_size[1])
+    intensity_map = np.zeros((x_max, y_max))
+    x_size, y_size = min(x_max, counts_on.shape[0]), min(y_max, counts_on.shape[1])
+    intensity_map[:x_size, :y_size] = 255.0 * (counts_on[:x_size, :y_size] - counts_off[:x_size, :y_size])
+
+    ax = fig.subplots()
+    image = ax.imshow(intensity_map.T, cmap='seismic_r', origin='upper', interpolation='nearest')
+    fig.colorbar(image, ax=ax, label="Net Intensity Change")
+    ax.set_title(f"Event Intensity Map - {event_file_name}")
+    ax.set_xlabel("X Pixel")
+    ax.set_ylabel("Y Pixel")
+    fig.tight_layout()
+
+def playback_image(state, gain=PLAYBACK_GAIN, scale=1):
+    """
+    # BGR video frame of decayed (OFF, ON) counts: ON events blue, OFF events red, as in the ON/OFF map
+    :param state: array of shape (2, X, Y)
+    :param gain: float - counts giving 63% brightness, brightness saturates instead of being renormalized per frame
+    :param scale: int - nearest neighbour upscaling factor
+    """
+    # OpenCV is only loaded by playback exports
+    import cv2
+    intensity = (255 * (1.0 - np.exp(-np.maximum(state, 0) / gain))).astype(np.uint8)
+    # rows of a video frame run along y
+    image = np.zeros(intensity.shape[2:0:-1] + (3,), dtype=np.uint8)
+    image[..., 0] = intensity[1].T
+    image[..., 2] = intensity[0].T
+    if scale > 1:
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_NEAREST)
+    return image
+
+def write_playback(windows, output_path, time_scale=1.0, decay=PLAYBACK_DECAY, fps=PLAYBACK_FPS):
+    """
+    # encode per-window (2, X, Y) event frames as a video, each frame adding its events to the decayed previous one
+    MP4 frames are written as they are made, so memory holds one frame whatever the recording length
+    :param windows: iterable of (window_index, t_start, t_stop, frame), see EVizTool.iter_representations
+    :param output_path: string - .mp4 or .gif (GIF frames are kept until written, at most MAX_GIF_FRAMES)
+    :param time_scale: float - seconds per timestamp tick, for the time stamp drawn on every frame
+    :param decay: float - share of the previous frame kept, 0 shows every window on its own
+    :param fps: int - video frames per second
+    :return: number of frames written
+    """
+    import cv2
+    extension = os.path.splitext(output_path)[1].lower()
+    if extension not in ('.mp4', '.gif'):
+        raise ValueError(f"Unsupported playback format: {extension}")
+    if extension == '.gif' and not hasattr(cv2, 'imwriteanimation'):
+        raise ValueError("GIF playback needs an OpenCV build with cv2.imwriteanimation, use .mp4")
+    state, writer, gif_frames, t_origin, n_frames = None, None, [], None, 0
+    try:
+        for _, t_start, _, frame in windows:
+            if state is None:
+                state, t_origin = frame.astype(np.float32), t_start
+                scale = max(1, -(-PLAYBACK_MIN_WIDTH // frame.shape[1]))
+            else:
+                state *= decay
+                state += frame
+            n_frames += 1
+            image = playback_image(state, scale=scale)
+            cv2.putText(image, f"{(t_start - t_origin) * time_scale:.3f}", (8, 24), cv2.FONT_HERSHEY_SIMPLEX,
+                        0.6, (255, 255, 255), 1, cv2.LINE_AA)
+            if extension == '.gif':
+                if len(gif_frames) == MAX_GIF_FRAMES:
+                    raise ValueError(f"GIF playback is limited to {MAX_GIF_FRAMES} frames, use .mp4")
+                gif_frames.append(image)
+                continue
+            if writer is None:
+                writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, image.shape[1::-1])
+                if not writer.isOpened():
+                    raise ValueError(f"OpenCV cannot encode {output_path}")
+            writer.write(image)
+    finally:
+        if writer is not None:
+            writer.release()
+    if gif_frames:
+        animation = cv2.Animation()
+        animation.frames = gif_frames
+        animation.durations = [int(1000 / fps)] * len(gif_frames)
+        cv2.imwriteanimation(output_path, animation)
+    return n_frames
+
+def _read_h5_event_columns(h5_dataset, chunk_rows=H5_READ_CHUNK_ROWS):
+    """Read an (N, 4) t/x/y/p event dataset into compact typed columns without a full-size temporary."""
+    n_events = h5_dataset.shape[0]
+
+    # contiguous, uncompressed datasets can be memory mapped straight from the file
+    offset = h5_dataset.id.get_offset() if h5_dataset.chunks is None and h5_dataset.compression is None else None
+    if offset is not None:
+        raw = np.memmap(h5_dataset.file.filename, dtype=h5_dataset.dtype, mode='r',
+                        offset=offset, shape=h5_dataset.shape)
+        return {name: raw[:, index].astype(EVENT_COLUMN_DTYPES[name], copy=False)
+                for name, index in H5_EVENT_COLUMNS.items()}
+
+    # otherwise read whole storage chunks at a time into preallocated typed columns
+    if h5_dataset.chunks is not None:
+        chunk_rows = max(h5_dataset.chunks[0], chunk_rows // h5_dataset.chunks[0] * h5_dataset.chunks[0])
+    columns = {name: np.empty(n_events, dtype=dtype) for name, dtype in EVENT_COLUMN_DTYPES.items()}
+    for start in range(0, n_events, chunk_rows):
+        stop = min(start + chunk_rows, n_events)
+        block = h5_dataset[start:stop]
+        for name, index in H5_EVENT_COLUMNS.items():
+            columns[name][start:stop] = block[:, index]
+    return columns
 
 def load_event_file(file_path):
+    """
+    # load an event recording as compact typed columns (no pandas DataFrame is built)
+    :param file_path: string - path to a "TD" struct .mat file or an .h5 file with an "events" dataset
+    :return: (file_path, EventColumns, (x_max, y_max))
+    """
     file_extension = os.path.splitext(file_path)[1]
-    
-    output_df = pd.DataFrame()
+
     x_max, y_max = None, None
 
     if file_extension == ".mat":
         mat_data = scipy.io.loadmat(file_path)
         mat_td_data = mat_data['TD']
-        mat_obj_data = mat_data['Obj']
-        mat_n_obj = mat_data['nObj']
         mat_x_max = mat_data['xMax']
         mat_y_max = mat_data['yMax']
 
-            # mat_file_entire_data = mat_obj_data
-        mat_file_entire_data = mat_td_data
-        mat_file_x_pix = mat_file_entire_data[0][0][0].flatten()
-        mat_file_y_pix = mat_file_entire_data[0][0][1].flatten()
-        mat_file_p = mat_file_entire_data[0][0][2].flatten()
-        mat_file_t = mat_file_entire_data[0][0][3].flatten()
+        # mat_file_entire_data = mat_data['Obj']
+        mat_file_entire_data = mat_td_data[0][0]
+        # TD field order differs between recordings (ts/x/y/p vs x/y/p/ts), so look fields up by name
+        columns = {name: np.asarray(mat_file_entire_data[field]).ravel().astype(EVENT_COLUMN_DTYPES[name], copy=False)
+                   for name, field in MAT_TD_FIELDS.items()}
         x_max = int(mat_x_max.flatten()[0])
         y_max = int(mat_y_max.flatten()[0])
+        del mat_data, mat_td_data, mat_file_entire_data
 
-        output_df = pd.DataFrame({'t': mat_file_t, 'x': mat_file_x_pix, 'y': mat_file_y_pix, 'p': mat_file_p})
+        events = EventColumns(columns['t'], columns['x'], columns['y'], columns['p'])
 
 # # for converted .mat files from .h5 files
 #     if file_extension == ".mat":
@@ -177,22 +569,15 @@ def load_event_file(file_path):
 
     elif file_extension == ".h5":
         with h5py.File(file_path, 'r') as file:
-            h5_dataset = file['events']
-            h5_file_entire_data = h5_dataset[:]
-
-        h5_file_entire_data_T = h5_file_entire_data.T
-        h5_file_x_pix = h5_file_entire_data_T[1]
-        h5_file_y_pix = h5_file_entire_data_T[2]
-        h5_file_p = h5_file_entire_data_T[3]
-        h5_file_t = h5_file_entire_data_T[0]
+            columns = _read_h5_event_columns(file['events'])
 
         # we know the sensor size from simulation and rendering
         x_max, y_max = 128, 128
         # x_max, y_max = 1024, 768
-        # temporal resolution in microseconds - 1e6
-
-        output_df = pd.DataFrame({'t': h5_file_t/1e6, 'x': h5_file_x_pix, 'y': h5_file_y_pix, 'p': h5_file_p})
-        # output_df = pd.DataFrame({'t': h5_file_t, 'x': h5_file_x_pix, 'y': h5_file_y_pix, 'p': h5_file_p})
+        # timestamps stay integer microseconds, plots convert them to seconds
+        events = EventColumns(columns['t'], columns['x'], columns['y'], columns['p'], time_scale=H5_TIME_SCALE)
 
+    else:
+        raise ValueError(f"Unsupported event file type: {file_extension}")
 
-    return file_path, output_df, (x_max, y_max)
+    return file_path, events, (x_max, y_max)
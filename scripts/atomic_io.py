@@ -0,0 +1,51 @@
+import os
+import json
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+def write_atomic(path, write, binary=False):
+    """
+    # write a file through a temp file in the same folder and os.replace, readers never see it half written
+    :param path: string - final file path, its folder must exist
+    :param write: callable(f) writing the content into the open temp file
+    :param binary: bool - open the temp file in binary mode
+    """
+    fd, tmp_path = tempfile.mkstemp(prefix='.', suffix=os.path.splitext(path)[1], dir=os.path.dirname(path) or '.')
+    try:
+        with os.fdopen(fd, 'wb' if binary else 'w') as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def write_json_atomic(path, data):
+    """write_atomic of one JSON document."""
+    write_atomic(path, lambda f: json.dump(data, f))
+
+@contextmanager
+def staged_folder(folder, prefix):
+    """
+    # build a folder in a private staging folder next to it, published whole by a rename once the block succeeds
+    when another writer publishes the same folder first, its copy is kept and the staging folder dropped
+    :param folder: string - final folder path, must not exist yet
+    :param prefix: string - staging folder name prefix, e.g. '.ingest-'
+    :return: context manager yielding the staging folder path
+    """
+    parent = os.path.dirname(folder.rstrip('/')) or '.'
+    os.makedirs(parent, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix=prefix, dir=parent)
+    try:
+        yield staging
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    try:
+        os.replace(staging, folder)
+    except OSError:
+        # another worker published the same folder first
+        shutil.rmtree(staging, ignore_errors=True)
@@ -0,0 +1,216 @@
+"""
+Headless batch mode: render every recording / .mat file under some folders, in parallel.
+
+    python -m scripts.batch uploads --output batch_output --workers 8
+
+Each input file gets <output>/<relative path>/ holding its images and a manifest.json; files whose manifest
+still matches the source (size, mtime) and settings are skipped. index.json and index.html summarize the run.
+"""
+import os
+import sys
+import json
+import html
+import time
+import shutil
+import argparse
+import scipy.io
+import h5py
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from scripts.EBVisualizer import load_event_file
+from scripts.event_filter import filtered_event_visualizer
+from scripts.event_stream import stream_event_file, needs_streaming, DEFAULT_CHUNK_SIZE
+from scripts.process_mat import process_mat_file
+from scripts.render import RENDER_PROFILES, PREVIEW_PROFILE, warm_up
+from scripts.instrumentation import collect_stages
+import scripts.instrumentation as instrumentation
+
+BATCH_OUTPUT_FOLDER = 'batch_output'
+BATCH_EXTENSIONS = ('.mat', '.h5')
+MANIFEST_NAME = 'manifest.json'
+# bump when the outputs of a file change, older manifests are then re-rendered
+MANIFEST_VERSION = 1
+# event recordings above this size are aggregated chunk by chunk, as in the app
+EVENT_STREAM_THRESHOLD = 512 * 1024 * 1024
+# 'event' renders EVizTool plots, 'mat' the generic process_mat_file variables, 'auto' picks per file
+FILE_KINDS = ('auto', 'event', 'mat')
+
+def find_input_files(paths, extensions=BATCH_EXTENSIONS):
+    """
+    # (file path, path relative to its input root) of every file to process, in a stable order
+    :param paths: list of files and folders, folders are walked recursively
+    """
+    files = []
+    for path in paths:
+        if os.path.isfile(path):
+            files.append((path, os.path.basename(path)))
+            continue
+        for folder, subfolders, names in os.walk(path):
+            subfolders.sort()
+            files.extend((os.path.join(folder, name), os.path.relpath(os.path.join(folder, name), path))
+                         for name in sorted(names) if name.endswith(extensions))
+    return files
+
+def detect_file_kind(file_path):
+    """'event' for recordings EVizTool reads (.h5 "events" dataset, .mat "TD" struct), 'mat' otherwise."""
+    if h5py.is_hdf5(file_path):
+        with h5py.File(file_path, 'r') as f:
+            name = 'events' if file_path.endswith('.h5') else 'TD'
+            return 'event' if name in f else 'mat'
+    # only the variable headers are read
+    return 'event' if any(name == 'TD' for name, _, _ in scipy.io.whosmat(file_path)) else 'mat'
+
+def _source_stamp(file_path):
+    stat = os.stat(file_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+def read_manifest(output_folder):
+    try:
+        with open(os.path.join(output_folder, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def is_up_to_date(manifest, file_path, settings, output_folder):
+    """True when a finished manifest was made from this very source file with the same settings."""
+    return (manifest is not None and manifest.get('version') == MANIFEST_VERSION
+            and manifest.get('state') == 'done' and manifest.get('settings') == settings
+            and manifest.get('source') == _source_stamp(file_path)
+            and all(os.path.exists(os.path.join(output_folder, result['file']))
+                    for result in manifest['results'] if result.get('file')))
+
+def _render_file(file_path, kind, output_folder, settings):
+    if kind == 'mat':
+        return process_mat_file(file_path, max_workers=1, output_folder=output_folder, profile=settings['profile'])
+    if needs_streaming(file_path, settings['stream_threshold']):
+        eviz_obj = stream_event_file(file_path, settings['chunk_size'], settings['event_filter'])
+    else:
+        eviz_obj = filtered_event_visualizer(*load_event_file(file_path), settings['event_filter'])
+    return eviz_obj.visualize_event_data(max_workers=1, output_folder=output_folder, profile=settings['profile'])
+
+def process_file(file_path, output_folder, settings):
+    """
+    # render one file into output_folder and write its manifest, run in a batch worker process
+    images are rendered into a staging folder that replaces output_folder once complete
+    :param settings: dict - kind, profile, chunk_size, stream_threshold, event_filter
+    :return: the manifest dict, 'state' is 'done' or 'error'
+    """
+    started = time.perf_counter()
+    manifest = {'version': MANIFEST_VERSION, 'path': os.path.abspath(file_path), 'source': _source_stamp(file_path),
+                'settings': settings}
+    staging_folder = f"{output_folder.rstrip(os.sep)}.partial-{os.getpid()}"
+    shutil.rmtree(staging_folder, ignore_errors=True)
+    os.makedirs(staging_folder)
+    with collect_stages() as timings:
+        try:
+            manifest['kind'] = detect_file_kind(file_path) if settings['kind'] == 'auto' else settings['kind']
+            results = _render_file(file_path, manifest['kind'], staging_folder, settings)
+            # every image sits next to the manifest
+            for result in results:
+                if result.get('file'):
+                    result['file'] = os.path.basename(result['file'])
+            manifest.update(state='done', results=results)
+        except Exception as e:
+            manifest.update(state='error', error=f"{type(e).__name__}: {e}", results=[])
+    manifest.update(seconds=time.perf_counter() - started, timings=timings)
+    with open(os.path.join(staging_folder, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=1)
+    shutil.rmtree(output_folder, ignore_errors=True)
+    os.replace(staging_folder, output_folder)
+    return manifest
+
+def _init_worker(log_stages):
+    instrumentation.LOG_STAGES = log_stages
+    warm_up()
+
+def _index_entry(relative_path, manifest, skipped):
+    return {'source': relative_path, 'state': 'skipped' if skipped else manifest['state'],
+            'kind': manifest.get('kind'), 'seconds': manifest.get('seconds'), 'error': manifest.get('error'),
+            'plots': [result['file'] for result in manifest['results'] if result.get('file')]}
+
+def write_index(output_root, entries):
+    """Write index.json and a browsable index.html linking every file's images."""
+    with open(os.path.join(output_root, 'index.json'), 'w') as f:
+        json.dump(entries, f, indent=1)
+    rows = []
+    for entry in entries:
+        links = ' '.join(f'<a href="{html.escape(entry["source"] + "/" + plot)}">{html.escape(plot)}</a>'
+                         for plot in entry['plots'])
+        seconds = '' if entry['seconds'] is None else f"{entry['seconds']:.1f}"
+        rows.append(f"<tr><td>{html.escape(entry['source'])}</td><td>{entry['state']}</td>"
+                    f"<td>{entry['kind'] or ''}</td><td>{seconds}</td>"
+                    f"<td>{links or html.escape(entry['error'] or '')}</td></tr>")
+    with open(os.path.join(output_root, 'index.html'), 'w') as f:
+        f.write("<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\"><title>Batch results</title></head><body>\n"
+                "<table border=\"1\"><tr><th>File</th><th>State</th><th>Kind</th><th>Seconds</th><th>Plots</th></tr>\n"
+                + '\n'.join(rows) + "\n</table>\n</body></html>\n")
+
+def run_batch(paths, output_root=BATCH_OUTPUT_FOLDER, workers=None, kind='auto', profile=PREVIEW_PROFILE,
+              force=False, chunk_size=DEFAULT_CHUNK_SIZE, stream_threshold=EVENT_STREAM_THRESHOLD, event_filter=None,
+              log_stages=False):
+    """
+    # process every file under paths across a pool of worker processes, one file per task
+    :param paths: list of input files / folders
+    :param output_root: string - folder receiving one sub folder per file plus index.json / index.html
+    :param workers: int - worker processes, None uses one per CPU
+    :param force: bool - re-render files whose outputs are up to date
+    :param event_filter: optional dict - hot_pixel_sigmas / ba_window noise filter of event recordings
+    :return: list of index entries, in input order
+    """
+    settings = {'kind': kind, 'profile': profile, 'chunk_size': chunk_size, 'stream_threshold': stream_threshold,
+                'event_filter': event_filter}
+    files = find_input_files(paths)
+    os.makedirs(output_root, exist_ok=True)
+    entries, pending = [None] * len(files), {}
+    for position, (file_path, relative_path) in enumerate(files):
+        manifest = read_manifest(os.path.join(output_root, relative_path))
+        if not force and is_up_to_date(manifest, file_path, settings, os.path.join(output_root, relative_path)):
+            entries[position] = _index_entry(relative_path, manifest, skipped=True)
+        else:
+            pending[position] = (file_path, relative_path)
+    print(f"{len(files)} files, {len(files) - len(pending)} up to date, {len(pending)} to process")
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(log_stages,)) as executor:
+            futures = {executor.submit(process_file, file_path, os.path.join(output_root, relative_path),
+                                       settings): position
+                       for position, (file_path, relative_path) in pending.items()}
+            for done, future in enumerate(as_completed(futures), start=1):
+                position = futures[future]
+                try:
+                    manifest = future.result()
+                except Exception as e:
+                    # the worker died (e.g. out of memory), the pool is broken and the remaining files fail too
+                    manifest = {'state': 'error', 'error': f"{type(e).__name__}: {e}", 'results': [], 'seconds': 0.0}
+                entries[position] = _index_entry(files[position][1], manifest, skipped=False)
+                print(f"[{done}/{len(pending)}] {files[position][0]}: {manifest['state']} "
+                      f"({manifest['seconds']:.1f}s){' - ' + manifest['error'] if 'error' in manifest else ''}")
+    write_index(output_root, entries)
+    return entries
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Render event recordings and .mat files without the web app.')
+    parser.add_argument('paths', nargs='+', help='files or folders (searched recursively for .mat / .h5)')
+    parser.add_argument('-o', '--output', default=BATCH_OUTPUT_FOLDER, help='output folder')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='worker processes, one per CPU by default')
+    parser.add_argument('--kind', choices=FILE_KINDS, default='auto', help='how files are rendered')
+    parser.add_argument('--profile', choices=sorted(RENDER_PROFILES), default=PREVIEW_PROFILE,
+                        help='image format / resolution')
+    parser.add_argument('--force', action='store_true', help='re-render files that are up to date')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='events per streamed chunk')
+    parser.add_argument('--hot-pixels', type=float, default=None, metavar='SIGMAS',
+                        help='drop events of hot pixels (counts this many deviations above the median)')
+    parser.add_argument('--ba-window', type=float, default=None, metavar='SECONDS',
+                        help='drop background activity: events without a neighbour event this recent')
+    parser.add_argument('--log-stages', action='store_true', help='print every stage timing of the workers')
+    args = parser.parse_args(argv)
+    event_filter = None
+    if args.hot_pixels is not None or args.ba_window is not None:
+        event_filter = {'hot_pixel_sigmas': args.hot_pixels, 'ba_window': args.ba_window}
+    entries = run_batch(args.paths, args.output, args.workers, args.kind, args.profile, args.force,
+                        args.chunk_size, event_filter=event_filter, log_stages=args.log_stages)
+    failed = [entry for entry in entries if entry['state'] == 'error']
+    print(f"index written to {os.path.join(args.output, 'index.html')}, {len(failed)} failed")
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
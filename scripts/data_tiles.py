@@ -0,0 +1,208 @@
+import os
+import functools
+import scipy.io
+import h5py
+import numpy as np
+from scripts.EBVisualizer import accumulate_polarity_counts
+from scripts.event_stream import EventFileReader, DEFAULT_CHUNK_SIZE
+from scripts.atomic_io import write_atomic
+
+# per-upload arrays derived for the data api (e.g. event count images), kept outside static/
+DATA_CACHE_FOLDER = 'cache/data'
+# edge length of every pyramid tile, in output samples
+TILE_SIZE = 256
+# upper bound on the buckets of one decimated series response
+MAX_SERIES_POINTS = 10000
+# rows / samples read from disk at a time while reducing, bounds the memory of one request
+DATA_READ_CHUNK = 1 << 20
+# count image tiles a client may ask for
+COUNT_IMAGE_LAYERS = ('off', 'on', 'net', 'total')
+
+def pyramid_levels(shape, tile_size=TILE_SIZE):
+    """Number of pyramid levels, level L shrinks every axis by 2**L and the last level fits in one tile."""
+    levels = 1
+    while max(shape) > tile_size << (levels - 1):
+        levels += 1
+    return levels
+
+def decimate_minmax(read_series, start, stop, points):
+    """
+    # min/max envelope of series[start:stop] in at most points buckets, read chunk by chunk
+    :param read_series: callable(start, stop) -> 1D array
+    :param start: int - first sample of the viewport
+    :param stop: int - end of the viewport (exclusive)
+    :param points: int - number of buckets, each bucket keeps its smallest and largest value
+    :return: dict - 'index' (first sample of every bucket), 'min' and 'max' lists
+    """
+    edges = np.unique(np.linspace(start, stop, points + 1).astype(np.int64))
+    bucket_min = np.full(len(edges) - 1, np.inf)
+    bucket_max = np.full(len(edges) - 1, -np.inf)
+    for chunk_start in range(start, stop, DATA_READ_CHUNK):
+        chunk_stop = min(chunk_start + DATA_READ_CHUNK, stop)
+        values = np.asarray(read_series(chunk_start, chunk_stop), dtype=np.float64)
+        # buckets overlapping this chunk, the first one may have started in the previous chunk
+        first = np.searchsorted(edges, chunk_start, side='right') - 1
+        last = np.searchsorted(edges, chunk_stop - 1, side='right') - 1
+        bucket_starts = np.maximum(edges[first:last + 1], chunk_start) - chunk_start
+        bucket_min[first:last + 1] = np.minimum(bucket_min[first:last + 1], np.minimum.reduceat(values, bucket_starts))
+        bucket_max[first:last + 1] = np.maximum(bucket_max[first:last + 1], np.maximum.reduceat(values, bucket_starts))
+    return {'index': edges[:-1].tolist(), 'min': bucket_min.tolist(), 'max': bucket_max.tolist()}
+
+def read_tile(read_window, shape, level, tile_row, tile_col, reduce='mean', tile_size=TILE_SIZE):
+    """
+    # one tile of a 2D array's resolution pyramid, each output sample reduces a 2**level square block
+    :param read_window: callable(row_start, row_stop, col_start, col_stop) -> 2D array
+    :param shape: tuple - (rows, cols) of the full resolution array
+    :param level: int - pyramid level, 0 is full resolution
+    :param tile_row: int - tile index along the rows
+    :param tile_col: int - tile index along the columns
+    :param reduce: 'mean' for sampled values, 'sum' for counts
+    :param tile_size: int - tile edge length in output samples
+    :return: float64 array of at most (tile_size, tile_size), smaller on the bottom / right border
+    """
+    if reduce not in ('mean', 'sum'):
+        raise ValueError(f"Unknown tile reduction: {reduce}")
+    if not 0 <= level < pyramid_levels(shape, tile_size):
+        raise ValueError(f"Level {level} is outside the pyramid of a {shape} array")
+    factor = 1 << level
+    row_start, col_start = tile_row * tile_size * factor, tile_col * tile_size * factor
+    if tile_row < 0 or tile_col < 0 or row_start >= shape[0] or col_start >= shape[1]:
+        raise ValueError(f"Tile ({tile_row}, {tile_col}) is outside level {level}")
+    row_stop = min(row_start + tile_size * factor, shape[0])
+    col_stop = min(col_start + tile_size * factor, shape[1])
+    col_blocks = np.arange(0, col_stop - col_start, factor)
+
+    tile = np.zeros((-(-(row_stop - row_start) // factor), len(col_blocks)))
+    # whole strips of factor rows are read at a time so blocks never straddle two reads
+    strip_rows = max(factor, DATA_READ_CHUNK // max(col_stop - col_start, 1) // factor * factor)
+    for strip_start in range(row_start, row_stop, strip_rows):
+        strip_stop = min(strip_start + strip_rows, row_stop)
+        block = np.asarray(read_window(strip_start, strip_stop, col_start, col_stop), dtype=np.float64)
+        block = np.add.reduceat(block, np.arange(0, strip_stop - strip_start, factor), axis=0)
+        out_row = (strip_start - row_start) // factor
+        tile[out_row:out_row + block.shape[0]] = np.add.reduceat(block, col_blocks, axis=1)
+
+    if reduce == 'mean':
+        # border blocks cover fewer than factor x factor samples
+        row_counts = np.minimum(factor, (row_stop - row_start) - np.arange(tile.shape[0]) * factor)
+        col_counts = np.minimum(factor, (col_stop - col_start) - col_blocks)
+        tile /= np.outer(row_counts, col_counts)
+    return tile
+
+class MatVariable:
+    def __init__(self, file_path, name):
+        """
+        # lazy view of one numeric variable of a .mat file, v7.3 variables are sliced straight from disk
+        :param file_path: string - .mat file
+        :param name: string - variable name, struct fields separated by "." as in the results page
+        """
+        self.name = name
+        self._h5_file = None
+        if h5py.is_hdf5(file_path):
+            self._h5_file = h5py.File(file_path, 'r')
+            data = self._h5_file.get(name.replace('.', '/'))
+            if not isinstance(data, h5py.Dataset):
+                self.close()
+                raise KeyError(name)
+            # MATLAB writes column-major arrays, h5py sees them transposed
+            self.shape = tuple(reversed(data.shape))
+        else:
+            data = _load_v5_variable(file_path, name)
+            self.shape = data.shape
+        if data.dtype.kind not in 'fiub':
+            self.close()
+            raise ValueError(f"{name} is not a real numeric array (dtype={data.dtype})")
+        self._data = data
+        # row / column vectors are served as 1D series
+        self.ndim = len([size for size in self.shape if size > 1]) if len(self.shape) == 2 else len(self.shape)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self._h5_file is not None:
+            self._h5_file.close()
+            self._h5_file = None
+
+    def describe(self):
+        return {'name': self.name, 'shape': list(self.shape), 'dtype': str(self._data.dtype)}
+
+    def series_length(self):
+        if self.ndim != 1:
+            raise ValueError(f"{self.name} is not 1D (shape={self.shape})")
+        return max(self.shape)
+
+    def read_series(self, start, stop):
+        if self._data.ndim == 1:
+            return self._data[start:stop]
+        if self._data.shape[0] == 1:
+            return self._data[0, start:stop]
+        return self._data[start:stop, 0]
+
+    def read_window(self, row_start, row_stop, col_start, col_stop):
+        if self._h5_file is not None:
+            return self._data[col_start:col_stop, row_start:row_stop].T
+        return self._data[row_start:row_stop, col_start:col_stop]
+
+@functools.lru_cache(maxsize=4)
+def _load_v5_variable(file_path, name):
+    # v5 files can only be parsed variable by variable, keep the last few for repeated viewport requests
+    top_level, *fields = name.split('.')
+    mat_data = scipy.io.loadmat(file_path, variable_names=[top_level], struct_as_record=False, squeeze_me=True)
+    if top_level not in mat_data:
+        raise KeyError(name)
+    data = mat_data[top_level]
+    for field in fields:
+        if not hasattr(data, field):
+            raise KeyError(name)
+        data = getattr(data, field)
+    return np.asarray(data)
+
+def list_mat_variables(file_path):
+    """Return [{'name', 'shape', 'dtype'}] for every array the data api can serve from a .mat file."""
+    if not h5py.is_hdf5(file_path):
+        return [{'name': name, 'shape': list(shape), 'dtype': mat_class}
+                for name, shape, mat_class in scipy.io.whosmat(file_path)]
+    variables = []
+    def visit(name, item):
+        if isinstance(item, h5py.Dataset) and not name.startswith('#'):
+            variables.append({'name': name.replace('/', '.'), 'shape': list(reversed(item.shape)),
+                              'dtype': str(item.dtype)})
+    with h5py.File(file_path, 'r') as f:
+        f.visititems(visit)
+    return variables
+
+def event_count_images(file_path, cache_path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    # (2, X, Y) OFF / ON count images of an event recording, computed once in bounded memory
+    :param file_path: string - .h5 or .mat event recording
+    :param cache_path: string - .npy file the images are saved to and memory mapped from
+    :param chunk_size: int - events read at a time
+    """
+    if not os.path.exists(cache_path):
+        with EventFileReader(file_path, chunk_size) as reader:
+            count_images = np.zeros((2, int(reader.sensor_size[0]), int(reader.sensor_size[1])), dtype=np.int64)
+            for chunk in reader.iter_chunks():
+                count_images = accumulate_polarity_counts(chunk.x, chunk.y, chunk.p, reader.sensor_size,
+                                                          out=count_images)
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        # concurrent requests may compute the same images, the rename keeps the file whole
+        write_atomic(cache_path, lambda f: np.save(f, count_images), binary=True)
+    return np.load(cache_path, mmap_mode='r')
+
+def count_image_layer(count_images, layer):
+    """Return a read_window callable over one layer ('off', 'on', 'net' = on - off, 'total') of the count images."""
+    if layer not in COUNT_IMAGE_LAYERS:
+        raise ValueError(f"Unknown count image layer: {layer}")
+    def read_window(row_start, row_stop, col_start, col_stop):
+        off = count_images[0, row_start:row_stop, col_start:col_stop]
+        on = count_images[1, row_start:row_stop, col_start:col_stop]
+        if layer == 'off':
+            return off
+        if layer == 'on':
+            return on
+        return on - off if layer == 'net' else on + off
+    return read_window
@@ -0,0 +1,192 @@
+import numpy as np
+from scripts.EBVisualizer import (EVizTool, EventColumns, accumulate_polarity_counts, seconds_per_tick,
+                                  EVENT_WINDOW_CHUNK)
+from scripts.instrumentation import stage
+
+# a pixel is hot when its event count lies this many (MAD based) standard deviations above the median active pixel
+DEFAULT_HOT_PIXEL_SIGMAS = 5.0
+# ... and is at least this many times the median count, so a flat count distribution flags nothing
+HOT_PIXEL_MIN_RATIO = 5.0
+# background activity window in seconds: an event needs a neighbour event at most this much older to be kept
+DEFAULT_BA_WINDOW = 0.01
+# 8-connected neighbourhood of the background activity filter
+NEIGHBOUR_OFFSETS = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1) if dx or dy]
+# "no event yet" timestamp, far enough from int64 limits that t - NEVER cannot overflow
+NEVER = np.iinfo(np.int64).min // 2
+# largest pixel * time key used to binary search a chunk, longer chunks are split in time
+MAX_SORT_KEY = 1 << 62
+
+def hot_pixel_mask(counts, sigmas=DEFAULT_HOT_PIXEL_SIGMAS):
+    """
+    # pixels firing far more often than the rest of the sensor, from per-pixel event counts (i.e. rates)
+    :param counts: int array of shape (X, Y) - events per pixel over the whole recording
+    :param sigmas: float - robust standard deviations above the median active pixel
+    :return: bool array of shape (X, Y)
+    """
+    active = counts[counts > 0]
+    if not len(active):
+        return np.zeros(counts.shape, dtype=bool)
+    median = np.median(active)
+    # median absolute deviation, scaled to a standard deviation for normally distributed counts
+    spread = 1.4826 * np.median(np.abs(active - median))
+    return counts > max(median + sigmas * spread, HOT_PIXEL_MIN_RATIO * median)
+
+class EventFilter:
+    def __init__(self, sensor_size, tick_seconds=1.0, hot_pixels=None, ba_window=None):
+        """
+        # chunked noise filter: drops hot pixel events, then background activity (events without a recent neighbour)
+        chunks must arrive in time order, the per-pixel last-timestamp array carries over from chunk to chunk
+        :param sensor_size: tuple - (x_max, y_max), grown to cover every observed coordinate
+        :param tick_seconds: float - seconds per timestamp tick (1e-6 for .mat and .h5), see seconds_per_tick
+        :param hot_pixels: optional bool array of shape (X, Y), see hot_pixel_mask
+        :param ba_window: float - background activity window in seconds, None keeps every non-hot event
+        """
+        self.shape = (int(sensor_size[0]), int(sensor_size[1]))
+        if hot_pixels is not None:
+            self.shape = (max(self.shape[0], hot_pixels.shape[0]), max(self.shape[1], hot_pixels.shape[1]))
+        self.hot_pixels = None if hot_pixels is None else self._padded(hot_pixels, False)
+        self.ba_ticks = None if ba_window is None else int(round(ba_window / tick_seconds))
+        self.last_t = None if ba_window is None else np.full(self.shape, NEVER, dtype=np.int64)
+        self.n_events = 0
+        self.hot_pixel_events = 0
+        self.background_events = 0
+
+    def _padded(self, image, fill):
+        if image.shape == self.shape:
+            return image
+        padded = np.full(self.shape, fill, dtype=image.dtype)
+        padded[:image.shape[0], :image.shape[1]] = image
+        return padded
+
+    def _grow(self, x_size, y_size):
+        # .mat coordinates are 1-based, so x == x_max does occur
+        shape = (max(self.shape[0], x_size), max(self.shape[1], y_size))
+        if shape != self.shape:
+            self.shape = shape
+            if self.hot_pixels is not None:
+                self.hot_pixels = self._padded(self.hot_pixels, False)
+            if self.last_t is not None:
+                self.last_t = self._padded(self.last_t, NEVER)
+
+    def apply(self, chunk):
+        """Filter one EventColumns chunk, returning the kept events."""
+        self.n_events += len(chunk)
+        if not len(chunk):
+            return chunk
+        x = np.asarray(chunk.x, dtype=np.int64)
+        y = np.asarray(chunk.y, dtype=np.int64)
+        self._grow(int(x.max()) + 1, int(y.max()) + 1)
+        keep = np.ones(len(chunk), dtype=bool)
+        if self.hot_pixels is not None:
+            keep = ~self.hot_pixels[x, y]
+            self.hot_pixel_events += len(keep) - int(keep.sum())
+        if self.last_t is not None:
+            candidates = np.flatnonzero(keep)
+            t = np.asarray(chunk.t, dtype=np.int64)[candidates]
+            if len(t) > 1 and np.any(t[1:] < t[:-1]):
+                # the neighbour search needs time order within the chunk
+                candidates = candidates[np.argsort(t, kind='stable')]
+                t = np.asarray(chunk.t, dtype=np.int64)[candidates]
+            supported = self._background_support(t, x[candidates], y[candidates])
+            keep[candidates[~supported]] = False
+            self.background_events += len(supported) - int(supported.sum())
+        if keep.all():
+            return chunk
+        kept = np.flatnonzero(keep)
+        return EventColumns(chunk.t[kept], chunk.x[kept], chunk.y[kept], chunk.p[kept], time_scale=chunk.time_scale)
+
+    def _background_support(self, t, x, y):
+        """
+        # True for events with an event at one of their 8 neighbours at most ba_ticks earlier (t' <= t)
+        every pixel's events are sorted into one (pixel, t) key array; one binary search per neighbour offset finds
+        the latest neighbour event, falling back to last_t for neighbours silent in this chunk
+        """
+        if not len(t):
+            return np.zeros(0, dtype=bool)
+        t_origin = int(t[0])
+        span = int(t[-1]) - t_origin + 1
+        n_pixels = self.shape[0] * self.shape[1]
+        if len(t) > 1 and n_pixels * span >= MAX_SORT_KEY:
+            half = len(t) // 2
+            return np.concatenate([self._background_support(t[:half], x[:half], y[:half]),
+                                   self._background_support(t[half:], x[half:], y[half:])])
+        y_size = self.shape[1]
+        last_t = self.last_t.reshape(-1)
+        t_relative = t - t_origin
+        keys = np.sort((x * y_size + y) * span + t_relative)
+        supported = np.zeros(len(t), dtype=bool)
+        for dx, dy in NEIGHBOUR_OFFSETS:
+            nx, ny = x + dx, y + dy
+            inside = (nx >= 0) & (nx < self.shape[0]) & (ny >= 0) & (ny < y_size)
+            neighbour = np.where(inside, nx * y_size + ny, 0)
+            position = np.searchsorted(keys, neighbour * span + t_relative, side='right') - 1
+            found_key = keys[np.maximum(position, 0)]
+            found = (position >= 0) & (found_key // span == neighbour)
+            neighbour_t = np.where(found, found_key % span + t_origin, last_t[neighbour])
+            supported |= inside & (t - neighbour_t <= self.ba_ticks)
+
+        # every (non hot) event updates its pixel's timestamp, kept or not
+        pixels = keys // span
+        latest = np.r_[pixels[1:] != pixels[:-1], True]
+        last_t[pixels[latest]] = keys[latest] % span + t_origin
+        return supported
+
+    def report(self):
+        """Counts of the filtered events, with a one-line summary for the results page."""
+        removed = self.hot_pixel_events + self.background_events
+        hot_pixels = 0 if self.hot_pixels is None else int(self.hot_pixels.sum())
+        return {'events': self.n_events, 'kept_events': self.n_events - removed, 'hot_pixels': hot_pixels,
+                'hot_pixel_events': self.hot_pixel_events, 'background_events': self.background_events,
+                'summary': f"{removed} of {self.n_events} events removed: {self.hot_pixel_events} from "
+                           f"{hot_pixels} hot pixels, {self.background_events} background activity"}
+
+def filter_events(events, sensor_size, hot_pixel_sigmas=None, ba_window=None, chunk_size=EVENT_WINDOW_CHUNK,
+                  tick_seconds=None):
+    """
+    # noise filter an in-memory recording between load_event_file and EVizTool
+    :param events: EventColumns, sorted by time first when they are not
+    :param tick_seconds: float - seconds per timestamp tick, None for events.time_scale (see seconds_per_tick)
+    :param hot_pixel_sigmas: float - see hot_pixel_mask, None keeps hot pixels
+    :param ba_window: float - see EventFilter, None skips the background activity filter
+    :return: (filtered EventColumns, EventFilter.report())
+    """
+    if len(events) > 1 and np.any(events.t[1:] < events.t[:-1]):
+        order = np.argsort(events.t, kind='stable')
+        events = EventColumns(*(np.asarray(events[name])[order] for name in 'txyp'), time_scale=events.time_scale)
+    hot_pixels = None
+    if hot_pixel_sigmas is not None:
+        counts = accumulate_polarity_counts(events.x, events.y, events.p, sensor_size)
+        hot_pixels = hot_pixel_mask(counts.sum(axis=0), hot_pixel_sigmas)
+    tick_seconds = events.time_scale if tick_seconds is None else tick_seconds
+    event_filter = EventFilter(sensor_size, tick_seconds, hot_pixels, ba_window)
+    with stage('filter_events'):
+        chunks = [event_filter.apply(events.slice(start, start + chunk_size))
+                  for start in range(0, len(events), chunk_size)]
+    if len(chunks) != 1:
+        chunks = [EventColumns(*(np.concatenate([chunk[name] for chunk in chunks]) if chunks else events[name][:0]
+                                 for name in 'txyp'), time_scale=events.time_scale)]
+    return chunks[0], event_filter.report()
+
+def filtered_event_visualizer(event_name, events, sensor_size, event_filter=None):
+    """
+    # EVizTool over in-memory events, noise filtered first when event_filter is given
+    :param event_filter: optional dict - hot_pixel_sigmas / ba_window, see filter_events
+    """
+    if event_filter is None:
+        return EVizTool(event_name, events, sensor_size)
+    events, report = filter_events(events, sensor_size, tick_seconds=seconds_per_tick(event_name, events.time_scale),
+                                   **event_filter)
+    eviz_obj = EVizTool(event_name, events, sensor_size)
+    eviz_obj.filter_report = report
+    return eviz_obj
+
+def reader_event_filter(reader, hot_pixel_sigmas=None, ba_window=None):
+    """EventFilter for a streamed EventFileReader, the hot pixel mask costs one extra pass over the file."""
+    hot_pixels = None
+    if hot_pixel_sigmas is not None:
+        with stage('hot_pixel_scan'):
+            counts = None
+            for chunk in reader.iter_chunks():
+                counts = accumulate_polarity_counts(chunk.x, chunk.y, chunk.p, reader.sensor_size, out=counts)
+            hot_pixels = hot_pixel_mask(counts.sum(axis=0), hot_pixel_sigmas) if counts is not None else None
+    return EventFilter(reader.sensor_size, reader.tick_seconds, hot_pixels, ba_window)
@@ -0,0 +1,125 @@
+import os
+import json
+import shutil
+import numpy as np
+from scripts.EBVisualizer import EventColumns
+from scripts.event_stream import EventFileReader, DEFAULT_CHUNK_SIZE
+from scripts.atomic_io import staged_folder
+
+# events per index block, the unit the spatial summary is kept for
+INDEX_BLOCK_SIZE = 1 << 16
+# bump when the on-disk layout changes, older indexes are rebuilt
+INDEX_VERSION = 1
+
+class EventIndex:
+    def __init__(self, index_folder):
+        """
+        # time-range / ROI query index of one event recording, see build_event_index
+        t.npy - every timestamp in file order (sorted), memory mapped, binary searched per query
+        blocks.npz - per INDEX_BLOCK_SIZE events: row offset and x / y bounding box
+        meta.json - source sensor_size, time_scale, n_events
+        :param index_folder: string - folder written by build_event_index
+        """
+        with open(os.path.join(index_folder, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.t = np.load(os.path.join(index_folder, 't.npy'), mmap_mode='r')
+        with np.load(os.path.join(index_folder, 'blocks.npz')) as blocks:
+            self.block_offsets = blocks['offsets']
+            self.block_bounds = blocks['bounds']
+        self.time_scale = self.meta['time_scale']
+        self.sensor_size = tuple(self.meta['sensor_size'])
+        self.n_events = self.meta['n_events']
+
+    def row_range(self, t0=None, t1=None):
+        """Rows [start, stop) of the events with t0 <= t < t1 (plot time units), two binary searches."""
+        start = 0 if t0 is None else int(np.searchsorted(self.t, int(np.ceil(t0 / self.time_scale)), side='left'))
+        stop = self.n_events if t1 is None else int(np.searchsorted(self.t, int(np.ceil(t1 / self.time_scale)),
+                                                                   side='left'))
+        return start, max(start, stop)
+
+    def query(self, reader, t0=None, t1=None, roi=None):
+        """
+        # events with t0 <= t < t1 inside roi, reading only the blocks the time range and roi can touch
+        :param reader: open EventFileReader of the indexed recording
+        :param t0: float - range start in plot time units (t * time_scale), None from the first event
+        :param t1: float - range end (exclusive), None up to the last event
+        :param roi: tuple - (x0, y0, x1, y1) pixel box, x0 <= x < x1 and y0 <= y < y1, None for the whole sensor
+        :return: EventColumns
+        """
+        start, stop = self.row_range(t0, t1)
+        first_block = np.searchsorted(self.block_offsets, start, side='right') - 1
+        last_block = np.searchsorted(self.block_offsets, stop, side='left')
+        pieces = []
+        for block in range(max(first_block, 0), last_block):
+            if roi is not None:
+                x_min, x_max, y_min, y_max = self.block_bounds[block]
+                if x_max < roi[0] or x_min >= roi[2] or y_max < roi[1] or y_min >= roi[3]:
+                    continue
+            row_start = max(start, int(self.block_offsets[block]))
+            row_stop = min(stop, int(self.block_offsets[block + 1]))
+            events = reader.read_rows(row_start, row_stop)
+            if roi is not None:
+                inside = np.flatnonzero((events.x >= roi[0]) & (events.x < roi[2]) &
+                                        (events.y >= roi[1]) & (events.y < roi[3]))
+                events = EventColumns(events.t[inside], events.x[inside], events.y[inside], events.p[inside],
+                                      time_scale=events.time_scale)
+            pieces.append(events)
+        if not pieces:
+            return reader.read_rows(0, 0)
+        return EventColumns(*(np.concatenate([piece[name] for piece in pieces]) for name in 'txyp'),
+                            time_scale=self.time_scale)
+
+def build_event_index(file_path, index_folder, chunk_size=DEFAULT_CHUNK_SIZE, block_size=INDEX_BLOCK_SIZE):
+    """
+    # scan an event recording once and write its EventIndex, an existing current index is reused
+    :param file_path: string - .h5 or .mat event recording, timestamps must be in non-decreasing order
+    :param index_folder: string - folder the index is written to (published whole, by a rename)
+    :param chunk_size: int - events read at a time, rounded to whole blocks
+    :return: EventIndex
+    """
+    meta_path = os.path.join(index_folder, 'meta.json')
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            if json.load(f).get('version') == INDEX_VERSION:
+                return EventIndex(index_folder)
+        shutil.rmtree(index_folder, ignore_errors=True)
+
+    with staged_folder(index_folder, '.index-') as staging:
+        with EventFileReader(file_path, max(block_size, chunk_size // block_size * block_size)) as reader:
+            t = np.lib.format.open_memmap(os.path.join(staging, 't.npy'), mode='w+', dtype=np.int64,
+                                          shape=(reader.n_events,))
+            bounds, last_t = [], None
+            for chunk_start, chunk in zip(range(0, reader.n_events, reader.chunk_size), reader.iter_chunks()):
+                unsorted = np.any(chunk.t[1:] < chunk.t[:-1]) or (last_t is not None and len(chunk)
+                                                                   and chunk.t[0] < last_t)
+                if unsorted:
+                    raise ValueError(f"{os.path.basename(file_path)} is not time ordered, it cannot be indexed")
+                t[chunk_start:chunk_start + len(chunk)] = chunk.t
+                last_t = chunk.t[-1] if len(chunk) else last_t
+                # chunks hold whole blocks, so every block summary comes from a single reduceat
+                block_starts = np.arange(0, len(chunk), block_size)
+                if len(block_starts):
+                    bounds.append(np.column_stack([np.minimum.reduceat(chunk.x, block_starts),
+                                                   np.maximum.reduceat(chunk.x, block_starts),
+                                                   np.minimum.reduceat(chunk.y, block_starts),
+                                                   np.maximum.reduceat(chunk.y, block_starts)]))
+            t.flush()
+            del t
+            offsets = np.r_[np.arange(0, reader.n_events, block_size), reader.n_events].astype(np.int64)
+            np.savez(os.path.join(staging, 'blocks.npz'), offsets=offsets,
+                     bounds=np.concatenate(bounds) if bounds else np.zeros((0, 4), dtype=np.int64))
+            with open(os.path.join(staging, 'meta.json'), 'w') as f:
+                json.dump({'version': INDEX_VERSION, 'source': os.path.basename(file_path),
+                           'sensor_size': [int(size) for size in reader.sensor_size],
+                           'time_scale': reader.time_scale, 'n_events': int(reader.n_events),
+                           'block_size': block_size}, f)
+    return EventIndex(index_folder)
+
+def query_event_file(file_path, index_folder, t0=None, t1=None, roi=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    # events of a recording inside a time range and roi, building the index on first use
+    :return: (EventColumns, sensor_size)
+    """
+    index = build_event_index(file_path, index_folder, chunk_size)
+    with EventFileReader(file_path, chunk_size) as reader:
+        return index.query(reader, t0, t1, roi), index.sensor_size
@@ -0,0 +1,214 @@
+import os
+import numpy as np
+import h5py
+from scripts.EBVisualizer import EventColumns, write_playback, PLAYBACK_DECAY, PLAYBACK_FPS
+from scripts.event_stream import EventFileReader, DEFAULT_CHUNK_SIZE
+
+REPRESENTATION_KINDS = ('frame', 'time_surface', 'voxel_grid')
+EXPORT_FORMATS = ('h5', 'npz')
+PLAYBACK_FORMATS = ('mp4', 'gif')
+# time bins of a voxel grid window
+DEFAULT_VOXEL_BINS = 5
+# decay constant of time surfaces, in seconds
+DEFAULT_TIME_SURFACE_TAU = 0.05
+# exports with more windows are refused, a too small time_window would otherwise write millions of empty frames
+MAX_EXPORT_WINDOWS = 100000
+
+class RepresentationBuilder:
+    def __init__(self, kind, sensor_size, origin=0, n_bins=DEFAULT_VOXEL_BINS, tau=DEFAULT_TIME_SURFACE_TAU,
+                 time_scale=1.0, tick_seconds=None):
+        """
+        # turns the events of one window into a dense tensor with a single scatter-add (np.bincount)
+        :param kind: 'frame' - (2, X, Y) OFF / ON counts
+                     'time_surface' - (2, X, Y) exp(-(t_end - t_last) / tau), t_last kept across windows
+                     'voxel_grid' - (n_bins, X, Y) polarity (+1 / -1) spread linearly over n_bins time bins
+        :param sensor_size: tuple - (X, Y), events outside it are dropped and counted in dropped_events
+        :param origin: int - coordinate of the first pixel (1 for .mat recordings)
+        :param n_bins: int - voxel grid time bins
+        :param tau: float - time surface decay, in seconds
+        :param time_scale: float - plot time units per timestamp tick, carried by the window EventColumns
+        :param tick_seconds: float - seconds per timestamp tick, None for time_scale (see seconds_per_tick)
+        """
+        if kind not in REPRESENTATION_KINDS:
+            raise ValueError(f"Unknown representation: {kind}")
+        self.kind = kind
+        self.sensor_size = (int(sensor_size[0]), int(sensor_size[1]))
+        self.origin = origin
+        self.n_bins = int(n_bins)
+        self.tau = float(tau)
+        self.time_scale = time_scale
+        self.tick_seconds = time_scale if tick_seconds is None else tick_seconds
+        self.n_pixels = self.sensor_size[0] * self.sensor_size[1]
+        self.dropped_events = 0
+        # latest timestamp per (polarity, pixel), the memory of the time surface
+        self._last_t = np.full(2 * self.n_pixels, -np.inf) if kind == 'time_surface' else None
+
+    @property
+    def shape(self):
+        planes = self.n_bins if self.kind == 'voxel_grid' else 2
+        return (planes,) + self.sensor_size
+
+    def build(self, events, t_start, t_stop):
+        """
+        # tensor of one window
+        :param events: EventColumns of the window, time ordered
+        :param t_start: int - window start in ticks
+        :param t_stop: int - window end in ticks (exclusive)
+        :return: float32 array of self.shape
+        """
+        x = np.asarray(events.x, dtype=np.int64) - self.origin
+        y = np.asarray(events.y, dtype=np.int64) - self.origin
+        valid = (x >= 0) & (x < self.sensor_size[0]) & (y >= 0) & (y < self.sensor_size[1])
+        self.dropped_events += int(len(valid) - np.count_nonzero(valid))
+        pixel = (x * self.sensor_size[1] + y)[valid]
+        on = (np.asarray(events.p) > 0)[valid]
+        t = np.asarray(events.t)[valid]
+
+        if self.kind == 'frame':
+            counts = np.bincount(on * self.n_pixels + pixel, minlength=2 * self.n_pixels)
+            return counts.reshape(self.shape).astype(np.float32)
+
+        if self.kind == 'time_surface':
+            np.maximum.at(self._last_t, on * self.n_pixels + pixel, t.astype(np.float64))
+            age = (t_stop - self._last_t) * self.tick_seconds
+            return np.exp(-age / self.tau).reshape(self.shape).astype(np.float32)
+
+        # voxel grid: each event is split between its two neighbouring time bins
+        position = (t - t_start) / max(t_stop - t_start, 1) * (self.n_bins - 1)
+        left = np.clip(position.astype(np.int64), 0, self.n_bins - 1)
+        right_weight = position - left
+        polarity = np.where(on, 1.0, -1.0)
+        index = np.concatenate([left * self.n_pixels + pixel,
+                                np.minimum(left + 1, self.n_bins - 1) * self.n_pixels + pixel])
+        weights = np.concatenate([polarity * (1.0 - right_weight), polarity * right_weight])
+        voxels = np.bincount(index, weights=weights, minlength=self.n_bins * self.n_pixels)
+        return voxels.reshape(self.shape).astype(np.float32)
+
+def _concat(pieces, time_scale):
+    if not pieces:
+        empty = np.empty(0, dtype=np.int64)
+        return EventColumns(empty, empty, empty, empty, time_scale=time_scale)
+    return EventColumns(*(np.concatenate([piece[name] for piece in pieces]) for name in 'txyp'),
+                        time_scale=time_scale)
+
+def iter_event_windows(chunks, t_origin, window_ticks=None, event_count=None, time_scale=1.0):
+    """
+    # regroup time ordered EventColumns chunks into fixed-interval or fixed-count windows
+    window edges are found with np.searchsorted on each sorted chunk instead of per-window masks
+    :param chunks: iterable of EventColumns
+    :param t_origin: int - start of the first time window, in ticks
+    :param window_ticks: int - window length for fixed-interval windows, empty windows are yielded too
+    :param event_count: int - events per window for fixed-count windows
+    :return: generator of (window_index, t_start, t_stop, EventColumns), holding one window plus one chunk
+    """
+    if (window_ticks is None) == (event_count is None):
+        raise ValueError("Give exactly one of time_window and event_count")
+    pending, pending_count, current = [], 0, 0
+
+    def window():
+        events = _concat(pending, time_scale)
+        if window_ticks is not None:
+            t_start = t_origin + current * window_ticks
+            return current, t_start, t_start + window_ticks, events
+        return current, int(events.t[0]), int(events.t[-1]) + 1, events
+
+    for chunk in chunks:
+        if not len(chunk):
+            continue
+        if window_ticks is not None:
+            first = (int(chunk.t[0]) - t_origin) // window_ticks
+            last = (int(chunk.t[-1]) - t_origin) // window_ticks
+            # close the windows that ended before this chunk
+            while current < first:
+                yield window()
+                pending, current = [], current + 1
+            cuts = np.searchsorted(chunk.t, t_origin + np.arange(first + 1, last + 1) * window_ticks)
+        else:
+            cuts = np.arange(event_count - pending_count, len(chunk), event_count)
+        bounds = np.r_[0, cuts, len(chunk)]
+        for piece, (start, stop) in enumerate(zip(bounds[:-1], bounds[1:])):
+            if piece:
+                yield window()
+                pending, pending_count, current = [], 0, current + 1
+            if stop > start:
+                pending.append(chunk.slice(start, stop))
+                pending_count += stop - start
+    if pending:
+        yield window()
+
+def iter_representations(chunks, t_origin, builder, time_window=None, event_count=None):
+    """Yield (window_index, t_start, t_stop, tensor) for every window of a time ordered chunk stream."""
+    window_ticks = None
+    if time_window is not None:
+        # time_window is in seconds
+        window_ticks = max(1, int(round(time_window / builder.tick_seconds)))
+    for window_index, t_start, t_stop, events in iter_event_windows(chunks, t_origin, window_ticks, event_count,
+                                                                    builder.time_scale):
+        yield window_index, t_start, t_stop, builder.build(events, t_start, t_stop)
+
+def _file_representations(reader, kind, time_window, event_count, **builder_params):
+    # builder and window stream of an open EventFileReader, refusing exports with too many windows
+    builder = RepresentationBuilder(kind, reader.sensor_size, reader.coordinate_origin,
+                                    time_scale=reader.time_scale, tick_seconds=reader.tick_seconds, **builder_params)
+    t_min, t_max = reader.time_range()
+    if time_window is not None:
+        n_windows = (t_max - t_min) // max(1, int(round(time_window / reader.tick_seconds))) + 1
+    else:
+        n_windows = -(-reader.n_events // max(1, int(event_count)))
+    if n_windows > MAX_EXPORT_WINDOWS:
+        raise ValueError(f"{n_windows} windows requested, at most {MAX_EXPORT_WINDOWS} are exported")
+    return builder, iter_representations(reader.iter_chunks(), t_min, builder, time_window, event_count)
+
+def export_representations(file_path, output_path, kind, time_window=None, event_count=None,
+                           chunk_size=DEFAULT_CHUNK_SIZE, **builder_params):
+    """
+    # stream an event recording from disk into per-window tensors saved as compressed HDF5 or .npz
+    :param file_path: string - .h5 or .mat event recording
+    :param output_path: string - .h5 (windows appended one at a time, bounded memory) or .npz (kept in memory)
+    :param kind: string - see RepresentationBuilder
+    :param time_window: float - fixed-interval windows, in seconds
+    :param event_count: int - fixed-count windows
+    :param builder_params: n_bins / tau, see RepresentationBuilder
+    :return: number of windows written
+    """
+    export_format = os.path.splitext(output_path)[1].lstrip('.')
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {export_format}")
+    with EventFileReader(file_path, chunk_size) as reader:
+        builder, windows = _file_representations(reader, kind, time_window, event_count, **builder_params)
+        attrs = {'kind': kind, 'source': os.path.basename(file_path), 'time_scale': reader.time_scale,
+                 'tick_seconds': reader.tick_seconds, 'time_window': time_window if time_window is not None else -1,
+                 'event_count': event_count if event_count is not None else -1}
+
+        if export_format == 'h5':
+            with h5py.File(output_path, 'w') as f:
+                tensors = f.create_dataset('representations', (0,) + builder.shape, maxshape=(None,) + builder.shape,
+                                           dtype=np.float32, chunks=(1,) + builder.shape, compression='gzip')
+                bounds = f.create_dataset('window_bounds', (0, 2), maxshape=(None, 2), dtype=np.int64)
+                for window_index, t_start, t_stop, tensor in windows:
+                    tensors.resize(window_index + 1, axis=0)
+                    bounds.resize(window_index + 1, axis=0)
+                    tensors[window_index] = tensor
+                    bounds[window_index] = (t_start, t_stop)
+                f.attrs.update(attrs, dropped_events=builder.dropped_events)
+                return tensors.shape[0]
+
+        tensors, bounds = [], []
+        for _, t_start, t_stop, tensor in windows:
+            tensors.append(tensor)
+            bounds.append((t_start, t_stop))
+        np.savez_compressed(output_path, representations=np.array(tensors, dtype=np.float32).reshape((-1,) + builder.shape),
+                            window_bounds=np.array(bounds, dtype=np.int64).reshape(-1, 2),
+                            dropped_events=builder.dropped_events, **attrs)
+        return len(tensors)
+
+def export_playback(file_path, output_path, time_window, decay=PLAYBACK_DECAY, fps=PLAYBACK_FPS,
+                    chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    # stream an event recording from disk into an animated MP4 / GIF playback, see write_playback
+    :param time_window: float - time covered by one video frame, in seconds
+    :return: number of frames written
+    """
+    with EventFileReader(file_path, chunk_size) as reader:
+        _, windows = _file_representations(reader, 'frame', time_window, None)
+        return write_playback(windows, output_path, reader.time_scale, decay, fps)
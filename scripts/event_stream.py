@@ -0,0 +1,310 @@
+import os
+import json
+import logging
+import shutil
+import h5py
+import numpy as np
+from scripts.EBVisualizer import (EVizTool, EventColumns, EVENT_COLUMN_DTYPES, H5_EVENT_COLUMNS, MAT_TD_FIELDS,
+                                  H5_TIME_SCALE, accumulate_polarity_counts, grow_count_images, linear_binning,
+                                  binned_gaussian_kde, load_event_file, seconds_per_tick, TIME_BINS,
+                                  MAT_COORDINATE_ORIGIN)
+from scripts.event_filter import reader_event_filter
+from scripts.instrumentation import log_event
+from scripts.atomic_io import staged_folder
+
+# events per chunk read from disk, bounds the memory used while streaming
+DEFAULT_CHUNK_SIZE = 1 << 20
+# sidecar of an ingested event store, bump EVENT_STORE_VERSION when the layout changes
+EVENT_STORE_META = 'meta.json'
+EVENT_STORE_VERSION = 1
+
+class EventFileReader:
+    def __init__(self, file_path, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        # chunked reader over an event recording, never holding more than chunk_size events
+        :param file_path: string - .h5 file with an "events" dataset, a .mat file with a "TD" struct or an event
+                          store folder written by ingest_event_file
+        :param chunk_size: int - number of events per chunk
+        """
+        self.file_path = file_path
+        # name shown in plot titles, the original file name for ingested stores
+        self.source_name = file_path
+        self.chunk_size = int(chunk_size)
+        self._h5_file = None
+        self._in_memory = None
+        self._time_range = None
+        file_extension = os.path.splitext(file_path)[1]
+        # .mat (DAVIS / MATLAB) pixel coordinates start at 1
+        self.coordinate_origin = MAT_COORDINATE_ORIGIN if file_extension == ".mat" else 0
+
+        if os.path.isdir(file_path):
+            # memory mapped columns, chunks are zero-copy slices
+            meta, self._in_memory = open_event_store(file_path)
+            self.n_events = meta['n_events']
+            self.sensor_size = tuple(meta['sensor_size'])
+            self.time_scale = meta['time_scale']
+            self.coordinate_origin = meta['coordinate_origin']
+            self.source_name = meta['source']
+            self._time_range = tuple(meta['time_range'])
+        elif file_extension == ".h5":
+            self._h5_file = h5py.File(file_path, 'r')
+            self._events = self._h5_file['events']
+            self.n_events = self._events.shape[0]
+            # we know the sensor size from simulation and rendering
+            self.sensor_size = (128, 128)
+            self.time_scale = H5_TIME_SCALE
+        elif file_extension == ".mat" and h5py.is_hdf5(file_path):
+            # MATLAB v7.3 files are HDF5, the TD struct is a group with one dataset per field
+            self._h5_file = h5py.File(file_path, 'r')
+            td_group = self._h5_file['TD']
+            self._fields = {name: td_group[field] for name, field in MAT_TD_FIELDS.items()}
+            self.n_events = max(self._fields['t'].shape)
+            self.sensor_size = (int(np.asarray(self._h5_file['xMax']).flatten()[0]),
+                                int(np.asarray(self._h5_file['yMax']).flatten()[0]))
+            self.time_scale = 1.0
+        else:
+            # older (v5) .mat files can only be parsed as a whole by scipy, so memory is NOT capped by chunk_size
+            log_event('mat_loaded_whole', logging.WARNING, file=file_path,
+                      message='not HDF5 based, loading it whole before streaming')
+            _, self._in_memory, self.sensor_size = load_event_file(file_path)
+            self.n_events = len(self._in_memory)
+            self.time_scale = self._in_memory.time_scale
+        # seconds per tick, time_scale is the plots' unit (raw ticks for .mat)
+        self.tick_seconds = seconds_per_tick(self.source_name, self.time_scale)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self._h5_file is not None:
+            self._h5_file.close()
+            self._h5_file = None
+
+    def read_rows(self, start, stop):
+        """Read events [start, stop) as compact typed columns."""
+        if self._in_memory is not None:
+            columns = {name: self._in_memory[name][start:stop] for name in EVENT_COLUMN_DTYPES}
+        elif self._h5_file is not None and 'TD' in self._h5_file:
+            columns = {name: _read_vector(dataset, start, stop).astype(EVENT_COLUMN_DTYPES[name], copy=False)
+                       for name, dataset in self._fields.items()}
+        else:
+            block = self._events[start:stop]
+            columns = {name: block[:, index].astype(EVENT_COLUMN_DTYPES[name])
+                       for name, index in H5_EVENT_COLUMNS.items()}
+        return EventColumns(columns['t'], columns['x'], columns['y'], columns['p'], time_scale=self.time_scale)
+
+    def iter_chunks(self):
+        """Yield the recording as consecutive EventColumns of at most chunk_size events."""
+        for start in range(0, self.n_events, self.chunk_size):
+            yield self.read_rows(start, min(start + self.chunk_size, self.n_events))
+
+    def iter_windows(self, time_window):
+        """
+        # yield (window_index, EventColumns) pieces that never straddle a fixed time window boundary
+        :param time_window: float - window length in seconds, windows start at the first timestamp
+        """
+        window_ticks = max(1, int(round(time_window / self.tick_seconds)))
+        t_origin = self.time_range()[0]
+        for chunk in self.iter_chunks():
+            window_index = (chunk.t - t_origin) // window_ticks
+            boundaries = np.flatnonzero(np.diff(window_index)) + 1
+            for start, stop in zip(np.r_[0, boundaries], np.r_[boundaries, len(chunk)]):
+                yield int(window_index[start]), chunk.slice(start, stop)
+
+    def time_range(self):
+        """Return (t_min, t_max) in timestamp ticks, scanning the time column chunk by chunk once."""
+        if self._time_range is None:
+            t_min, t_max = None, None
+            for start in range(0, self.n_events, self.chunk_size):
+                t_chunk = self._read_time(start, min(start + self.chunk_size, self.n_events))
+                t_min = t_chunk.min() if t_min is None else min(t_min, t_chunk.min())
+                t_max = t_chunk.max() if t_max is None else max(t_max, t_chunk.max())
+            self._time_range = (int(t_min), int(t_max)) if t_min is not None else (0, 0)
+        return self._time_range
+
+    def _read_time(self, start, stop):
+        if self._in_memory is not None:
+            return self._in_memory.t[start:stop]
+        if 'TD' in self._h5_file:
+            return _read_vector(self._fields['t'], start, stop)
+        return self._events[start:stop, H5_EVENT_COLUMNS['t']]
+
+def _read_vector(dataset, start, stop):
+    # MATLAB stores vectors as (1, N) or (N, 1) datasets
+    if dataset.ndim == 2 and dataset.shape[0] == 1:
+        return dataset[0, start:stop]
+    if dataset.ndim == 2:
+        return dataset[start:stop, 0]
+    return dataset[start:stop]
+
+class EventAccumulator:
+    def __init__(self, sensor_size, t_range, time_scale=1.0, n_time_bins=TIME_BINS):
+        """
+        # incremental per-polarity aggregates: count images, totals, time bins and time moments
+        :param sensor_size: tuple - (x_max, y_max)
+        :param t_range: tuple - (t_min, t_max) of the whole recording in timestamp ticks
+        :param time_scale: float - seconds per timestamp tick
+        :param n_time_bins: int - number of time grid points for the temporal density
+        """
+        self.sensor_size = sensor_size
+        self.time_scale = time_scale
+        self.t_min = float(t_range[0])
+        self.n_time_bins = n_time_bins
+        self.time_bin_width = max(float(t_range[1]) - self.t_min, 1.0) / (n_time_bins - 1)
+        self.count_images = np.zeros((2, int(sensor_size[0]), int(sensor_size[1])), dtype=np.int64)
+        self.polarity_totals = np.zeros(2, dtype=np.int64)
+        self.time_bins = np.zeros((2, n_time_bins), dtype=np.float64)
+        # per-polarity running mean / sum of squared deviations (Chan et al. parallel update)
+        self.time_mean = np.zeros(2)
+        self.time_m2 = np.zeros(2)
+        self.time_extrema = np.array([[np.inf, -np.inf], [np.inf, -np.inf]])
+
+    def update(self, chunk):
+        """Add one EventColumns chunk to the aggregates."""
+        p = np.asarray(chunk.p)
+        polarity = (p > 0).astype(np.int8)
+        self.count_images = accumulate_polarity_counts(chunk.x, chunk.y, polarity, self.sensor_size,
+                                                       out=self.count_images)
+        for index in (0, 1):
+            t = np.asarray(chunk.t[polarity == index], dtype=np.float64)
+            if not len(t):
+                continue
+            linear_binning(t, self.t_min, self.time_bin_width, self.n_time_bins, out=self.time_bins[index])
+            chunk_mean = t.mean()
+            self._merge_moments(index, len(t), chunk_mean, np.sum((t - chunk_mean) ** 2))
+            self.time_extrema[index] = (min(self.time_extrema[index, 0], t.min()),
+                                        max(self.time_extrema[index, 1], t.max()))
+            self.polarity_totals[index] += len(t)
+
+    def merge(self, other):
+        """Fold another accumulator over the same sensor and time grid into this one."""
+        self.count_images = grow_count_images(self.count_images, other.count_images.shape[1:])
+        self.count_images[:, :other.count_images.shape[1], :other.count_images.shape[2]] += other.count_images
+        self.time_bins += other.time_bins
+        for index in (0, 1):
+            if other.polarity_totals[index]:
+                self._merge_moments(index, other.polarity_totals[index], other.time_mean[index],
+                                    other.time_m2[index])
+                self.time_extrema[index] = (min(self.time_extrema[index, 0], other.time_extrema[index, 0]),
+                                            max(self.time_extrema[index, 1], other.time_extrema[index, 1]))
+        self.polarity_totals += other.polarity_totals
+
+    def _merge_moments(self, index, count, mean, m2):
+        # called before polarity_totals is bumped, so it still holds the previous count
+        previous = self.polarity_totals[index]
+        total = previous + count
+        delta = mean - self.time_mean[index]
+        self.time_mean[index] += delta * count / total
+        self.time_m2[index] += m2 + delta ** 2 * previous * count / total
+
+    def temporal_density(self):
+        """Return {polarity: (support_seconds, density_per_second)} for every polarity with 2+ events."""
+        densities = {}
+        for index in (0, 1):
+            count = self.polarity_totals[index]
+            if count < 2:
+                continue
+            std = np.sqrt(self.time_m2[index] / (count - 1))
+            support, density = binned_gaussian_kde(self.time_bins[index], self.t_min, self.time_bin_width, count,
+                                                   std, self.time_extrema[index, 0], self.time_extrema[index, 1])
+            densities[index] = (support * self.time_scale, density / self.time_scale)
+        return densities
+
+def open_event_store(store_folder):
+    """Return (meta dict, EventColumns of read-only memory mapped columns) of an ingested event store."""
+    with open(os.path.join(store_folder, EVENT_STORE_META)) as f:
+        meta = json.load(f)
+    columns = {name: np.load(os.path.join(store_folder, f'{name}.npy'), mmap_mode='r') for name in EVENT_COLUMN_DTYPES}
+    return meta, EventColumns(columns['t'], columns['x'], columns['y'], columns['p'], time_scale=meta['time_scale'])
+
+def is_event_store(store_folder):
+    """True when store_folder holds a complete event store of the current layout."""
+    try:
+        with open(os.path.join(store_folder, EVENT_STORE_META)) as f:
+            return json.load(f).get('version') == EVENT_STORE_VERSION
+    except (OSError, ValueError):
+        return False
+
+def ingest_event_file(file_path, store_folder, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    # convert an event recording once into uncompressed, memory mappable .npy columns (t, x, y, p) sorted by time,
+    plus a meta.json sidecar (source, sensor_size, time_scale, n_events, time_range, coordinate_origin)
+    every later EventFileReader / load_event_source opens the store in milliseconds instead of re-parsing the file
+    :param file_path: string - .h5 or .mat event recording
+    :param store_folder: string - folder of the store, published whole by a rename, reused when already current
+    :param chunk_size: int - events converted at a time (v5 .mat files are still parsed whole, once)
+    :return: store_folder
+    """
+    if is_event_store(store_folder):
+        return store_folder
+    shutil.rmtree(store_folder, ignore_errors=True)
+    with staged_folder(store_folder, '.ingest-') as staging:
+        with EventFileReader(file_path, chunk_size) as reader:
+            columns = {name: np.lib.format.open_memmap(os.path.join(staging, f'{name}.npy'), mode='w+', dtype=dtype,
+                                                       shape=(reader.n_events,))
+                       for name, dtype in EVENT_COLUMN_DTYPES.items()}
+            time_ordered, last_t = True, None
+            for start, chunk in zip(range(0, reader.n_events, reader.chunk_size), reader.iter_chunks()):
+                for name, column in columns.items():
+                    column[start:start + len(chunk)] = chunk[name]
+                if len(chunk):
+                    time_ordered = time_ordered and not np.any(chunk.t[1:] < chunk.t[:-1]) and \
+                        (last_t is None or chunk.t[0] >= last_t)
+                    last_t = chunk.t[-1]
+            if not time_ordered:
+                # rare for recorded streams, the permutation and one column are held in memory
+                order = np.argsort(columns['t'], kind='stable')
+                for column in columns.values():
+                    column[:] = column[order]
+            time_range = (int(columns['t'][0]), int(columns['t'][-1])) if reader.n_events else (0, 0)
+            meta = {'version': EVENT_STORE_VERSION, 'source': os.path.basename(file_path),
+                    'sensor_size': [int(size) for size in reader.sensor_size], 'time_scale': reader.time_scale,
+                    'n_events': int(reader.n_events), 'time_range': list(time_range),
+                    'coordinate_origin': reader.coordinate_origin}
+        for column in columns.values():
+            column.flush()
+        del columns
+        # the sidecar is written last, a store without it is never opened
+        with open(os.path.join(staging, EVENT_STORE_META), 'w') as f:
+            json.dump(meta, f)
+    return store_folder
+
+def load_event_source(file_path):
+    """load_event_file for recordings and ingested stores: (source name, EventColumns, sensor_size)."""
+    if os.path.isdir(file_path):
+        meta, events = open_event_store(file_path)
+        return meta['source'], events, tuple(meta['sensor_size'])
+    return load_event_file(file_path)
+
+def needs_streaming(file_path, threshold):
+    """
+    # decide between stream_event_file and the in-memory load_event_file path
+    :param file_path: string - .h5 or .mat event recording
+    :param threshold: int - file size in bytes above which HDF5 based files are streamed
+    """
+    if os.path.splitext(file_path)[1] == ".mat":
+        # v7.3 files are HDF5 and only readable through h5py; v5 files are parsed whole by scipy either way
+        return h5py.is_hdf5(file_path)
+    return os.path.getsize(file_path) > threshold
+
+def stream_event_file(file_path, chunk_size=DEFAULT_CHUNK_SIZE, event_filter=None):
+    """
+    # aggregate an event recording chunk by chunk, for files that do not fit in memory
+    :param file_path: string - .h5 or .mat event recording, or an ingested event store
+    :param chunk_size: int - number of events held in memory at a time
+    :param event_filter: optional dict - hot_pixel_sigmas / ba_window, every chunk is noise filtered before it is
+                         aggregated, see scripts.event_filter
+    :return: EVizTool rendering from the accumulated aggregates
+    """
+    with EventFileReader(file_path, chunk_size) as reader:
+        noise_filter = None if event_filter is None else reader_event_filter(reader, **event_filter)
+        accumulator = EventAccumulator(reader.sensor_size, reader.time_range(), reader.time_scale)
+        for chunk in reader.iter_chunks():
+            accumulator.update(chunk if noise_filter is None else noise_filter.apply(chunk))
+    eviz_obj = EVizTool.from_accumulator(reader.source_name, accumulator)
+    if noise_filter is not None:
+        eviz_obj.filter_report = noise_filter.report()
+    return eviz_obj
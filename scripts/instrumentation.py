@@ -0,0 +1,118 @@
+import sys
+import json
+import time
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, peak memory is then left out
+    resource = None
+
+# prefix of every exported Prometheus metric
+METRIC_PREFIX = 'matvisualizer'
+# print one JSON line per finished stage
+LOG_STAGES = True
+
+# library warnings and status messages, one JSON line each on stderr (see log_event)
+logger = logging.getLogger(METRIC_PREFIX)
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+
+# stage records of the job currently running in this context, see collect_stages
+_active_stages = contextvars.ContextVar('active_stages', default=None)
+# per-stage totals of this process, exported by metrics_text
+_stage_totals = {}
+_stage_totals_lock = threading.Lock()
+
+def peak_rss_bytes():
+    """Peak resident memory of this process so far, None where the platform does not report it."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+@contextmanager
+def collect_stages():
+    """Collect the records of every stage finished inside the block into the yielded list."""
+    records = []
+    token = _active_stages.set(records)
+    try:
+        yield records
+    finally:
+        _active_stages.reset(token)
+
+@contextmanager
+def stage(name, **labels):
+    """
+    # time a pipeline stage: wall time, CPU time and the process peak memory when it ends
+    :param name: string - stage name, the only label exported as a metric
+    :param labels: extra context kept in logs and the timing table (e.g. variable=key)
+    """
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    peak_start = peak_rss_bytes()
+    try:
+        yield
+    finally:
+        report_stage(name, time.perf_counter() - wall_start, time.process_time() - cpu_start, peak_start, **labels)
+
+def report_stage(name, wall_seconds, cpu_seconds, peak_start=None, **labels):
+    """
+    # record and log a finished stage, for spans a with block cannot wrap (module import, a whole request)
+    :param peak_start: int - peak_rss_bytes() when the stage began, None when unknown
+    """
+    peak_end = peak_rss_bytes()
+    record = dict(labels, stage=name, wall_seconds=wall_seconds, cpu_seconds=cpu_seconds,
+                  peak_rss_bytes=peak_end,
+                  # non-zero only when this stage raised the process peak
+                  peak_rss_growth_bytes=None if peak_end is None or peak_start is None else peak_end - peak_start)
+    records = _active_stages.get()
+    if records is not None:
+        records.append(record)
+    record_stages([record])
+    if LOG_STAGES:
+        print(json.dumps(dict(record, event='stage')), flush=True)
+
+def log_event(event, level=logging.INFO, **fields):
+    """
+    # log a warning / status message of the library as one JSON line, in the format of the stage records
+    :param event: string - short event name
+    :param level: int - logging level
+    :param fields: context of the message, values that are not JSON types are logged as strings
+    """
+    logger.log(level, json.dumps(dict(fields, event=event, level=logging.getLevelName(level).lower()), default=str))
+
+def record_stages(records):
+    """Add stage records, possibly timed in another process, to this process's metric totals."""
+    with _stage_totals_lock:
+        for record in records:
+            totals = _stage_totals.setdefault(record['stage'], {'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'peak': 0})
+            totals['calls'] += 1
+            totals['wall'] += record['wall_seconds']
+            totals['cpu'] += record['cpu_seconds']
+            totals['peak'] = max(totals['peak'], record.get('peak_rss_bytes') or 0)
+
+def metrics_text():
+    """Render the stage totals in the Prometheus text exposition format."""
+    metrics = (
+        ('stage_calls_total', 'counter', 'Finished pipeline stages', 'calls'),
+        ('stage_wall_seconds_total', 'counter', 'Wall time spent in each pipeline stage', 'wall'),
+        ('stage_cpu_seconds_total', 'counter', 'CPU time spent in each pipeline stage', 'cpu'),
+        ('stage_peak_rss_bytes', 'gauge', 'Highest process peak memory seen at the end of a stage', 'peak'),
+    )
+    with _stage_totals_lock:
+        totals = {name: dict(values) for name, values in _stage_totals.items()}
+    lines = []
+    for metric, metric_type, help_text, key in metrics:
+        lines.append(f"# HELP {METRIC_PREFIX}_{metric} {help_text}")
+        lines.append(f"# TYPE {METRIC_PREFIX}_{metric} {metric_type}")
+        for name in sorted(totals):
+            lines.append(f'{METRIC_PREFIX}_{metric}{{stage="{name}"}} {totals[name][key]}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,157 @@
+import os
+import json
+import time
+import uuid
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from scripts.instrumentation import collect_stages, record_stages
+from scripts.atomic_io import write_json_atomic
+
+JOB_FOLDER = 'jobs'
+# status files older than this many seconds are removed
+JOB_TTL_SECONDS = 24 * 3600
+
+def _write_job(job_folder, job_id, state):
+    write_json_atomic(os.path.join(job_folder, f"{job_id}.json"), state)
+
+def read_job(job_folder, job_id):
+    """Return the stored state of a job, or None for an unknown id."""
+    try:
+        with open(os.path.join(job_folder, f"{os.path.basename(job_id)}.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+class JobProgress:
+    def __init__(self, job_folder, job_id):
+        """
+        # picklable progress reporter handed to the job function inside the worker process
+        :param job_folder: string - folder holding one status file per job
+        :param job_id: string
+        """
+        self.job_folder = job_folder
+        self.job_id = job_id
+
+    def __call__(self, done, total, current=''):
+        _write_job(self.job_folder, self.job_id, {
+            'state': 'running',
+            'progress': {'done': done, 'total': total, 'current': current},
+        })
+
+def _run_job(job_folder, job_id, func, args):
+    """Run one job in the worker process, the returned stage timings are added to the app's metrics."""
+    progress = JobProgress(job_folder, job_id)
+    progress(0, 0, 'starting')
+    with collect_stages() as timings:
+        try:
+            results = func(*args, progress=progress, job_id=job_id)
+        except (KeyError, ValueError) as e:
+            # same errors the synchronous upload used to answer with a 400
+            _write_job(job_folder, job_id, {'state': 'error', 'error': str(e), 'timings': timings})
+            return timings
+        except Exception as e:
+            traceback.print_exc()
+            _write_job(job_folder, job_id, {'state': 'error', 'error': f"{type(e).__name__}: {e}", 'timings': timings})
+            return timings
+    _write_job(job_folder, job_id, {'state': 'done', 'results': results, 'timings': timings})
+    return timings
+
+class JobQueue:
+    def __init__(self, job_folder=JOB_FOLDER, max_workers=None, ttl=JOB_TTL_SECONDS, initializer=None):
+        """
+        # local process pool running uploads in the background, job state lives on disk
+        :param job_folder: string - folder holding one status file per job
+        :param max_workers: int - worker processes, defaults to the number of CPUs
+        :param ttl: int - seconds a job status is kept after its last update
+        :param initializer: optional picklable callable run once in every worker before its first job
+                            (e.g. scripts.render.warm_up)
+        """
+        self.job_folder = job_folder
+        self.max_workers = max_workers
+        self.ttl = ttl
+        self.initializer = initializer
+        self._executor = None
+        os.makedirs(job_folder, exist_ok=True)
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers, initializer=self.initializer)
+        return self._executor
+
+    def start(self):
+        """Start every worker now (running the initializer) instead of on the first submitted jobs."""
+        executor = self._get_executor()
+        # the pool only forks a worker when a task finds none idle, one no-op per worker starts them all
+        for _ in range(self.max_workers or os.cpu_count() or 1):
+            executor.submit(os.getpid)
+
+    def _job_finished(self, job_id, executor, future):
+        if future.cancelled():
+            return
+        if future.exception() is None:
+            record_stages(future.result() or [])
+            return
+        exc = future.exception()
+        if isinstance(exc, BrokenProcessPool):
+            # a worker killed mid-job (e.g. out of memory) breaks the whole pool and never writes a status
+            _write_job(self.job_folder, job_id,
+                       {'state': 'error', 'error': 'Worker process died while running the job'})
+            if self._executor is executor:
+                self._executor = None
+            return
+        # the job never reported its own outcome (e.g. func / args could not be pickled)
+        _write_job(self.job_folder, job_id, {'state': 'error', 'error': f"{type(exc).__name__}: {exc}"})
+
+    def submit(self, func, *args):
+        """
+        # queue func(*args, progress=JobProgress, job_id=job_id) in a worker process
+        :return: job id to poll with status()
+        """
+        self.expire()
+        job_id = uuid.uuid4().hex
+        _write_job(self.job_folder, job_id, {'state': 'queued'})
+        executor = self._get_executor()
+        try:
+            future = executor.submit(_run_job, self.job_folder, job_id, func, args)
+        except BrokenProcessPool:
+            # replace a pool broken by an earlier worker death
+            self._executor = None
+            executor = self._get_executor()
+            future = executor.submit(_run_job, self.job_folder, job_id, func, args)
+        future.add_done_callback(lambda done: self._job_finished(job_id, executor, done))
+        return job_id
+
+    def complete(self, results):
+        """Record an already finished job (e.g. a cache hit) so clients follow the same flow."""
+        self.expire()
+        job_id = uuid.uuid4().hex
+        _write_job(self.job_folder, job_id, {'state': 'done', 'results': results})
+        return job_id
+
+    def status(self, job_id):
+        return read_job(self.job_folder, job_id)
+
+    def is_active(self, job_id):
+        """True while a job is queued or running, False once finished, None for an unknown id."""
+        job = self.status(job_id)
+        if job is None:
+            return None
+        return job['state'] in ('queued', 'running')
+
+    def expire(self):
+        """Remove status files not updated for ttl seconds."""
+        cutoff = time.time() - self.ttl
+        for name in os.listdir(self.job_folder):
+            path = os.path.join(self.job_folder, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                # removed concurrently
+                pass
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
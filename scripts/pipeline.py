@@ -0,0 +1,111 @@
+import os
+import uuid
+from scripts.event_stream import (stream_event_file, needs_streaming, ingest_event_file, load_event_source,
+                                  DEFAULT_CHUNK_SIZE)
+from scripts.event_representations import export_representations, export_playback
+from scripts.event_index import query_event_file
+from scripts.event_filter import filtered_event_visualizer
+from scripts.process_mat import process_mat_file
+from scripts.result_cache import ResultCache
+from scripts.render import RENDER_WORKERS, PREVIEW_PROFILE
+from scripts.instrumentation import stage
+
+def _result_cache(settings):
+    return ResultCache(settings['RESULT_CACHE_FOLDER'], settings['RESULT_CACHE_MAX_BYTES'],
+                       settings['RESULT_INDEX_FOLDER'])
+
+def _event_source(file_path, store_folder, chunk_size=DEFAULT_CHUNK_SIZE):
+    # every job after the first reads the ingested columns instead of re-parsing the upload
+    if store_folder is None:
+        return file_path
+    with stage('ingest_event_file'):
+        return ingest_event_file(file_path, store_folder, chunk_size)
+
+def process_event_upload(file_path, store_folder, cache_key, settings, query=None, event_filter=None, progress=None,
+                         job_id=None):
+    """
+    # load, render and cache one uploaded event recording
+    :param file_path: string - saved upload
+    :param store_folder: string - event store the upload is ingested into on first use, None reads the upload
+    :param cache_key: string - ResultCache key for this upload and its rendering parameters
+    :param settings: dict - EVENT_STREAM_THRESHOLD, EVENT_CHUNK_SIZE, RESULT_CACHE_FOLDER,
+                     RESULT_CACHE_MAX_BYTES, RESULT_INDEX_FOLDER and optionally RENDER_WORKERS, RENDER_PROFILE
+    :param query: optional dict - index_folder, t0, t1, roi: only the events in this time range and roi are
+                  plotted, read through the recording's EventIndex
+    :param event_filter: optional dict - hot_pixel_sigmas, ba_window: hot pixel / background activity events are
+                         removed before anything is plotted, see scripts.event_filter
+    :param progress: optional callable(done, total, current) reporting per-plot progress
+    :param job_id: optional string - names the staging folder so the reaper can ask the job queue about it
+    :return: results list for results.html
+    """
+    streaming = needs_streaming(file_path, settings['EVENT_STREAM_THRESHOLD'])
+    source = _event_source(file_path, store_folder, settings['EVENT_CHUNK_SIZE'])
+    if query is not None:
+        with stage('query_event_index'):
+            events, sensor_size = query_event_file(source, query['index_folder'], query.get('t0'), query.get('t1'),
+                                                   query.get('roi'), settings['EVENT_CHUNK_SIZE'])
+        eviz_obj = filtered_event_visualizer(os.path.basename(file_path), events, sensor_size, event_filter)
+    elif streaming:
+        with stage('stream_event_file'):
+            eviz_obj = stream_event_file(source, settings['EVENT_CHUNK_SIZE'], event_filter)
+    else:
+        with stage('load_event_file'):
+            event_name, event_data, sensor_dim = load_event_source(source)
+        eviz_obj = filtered_event_visualizer(event_name, event_data, sensor_dim, event_filter)
+
+    # render into a private staging folder, published under the cache key only once complete
+    result_cache = _result_cache(settings)
+    staging_folder = result_cache.staging_folder(job_id or uuid.uuid4().hex)
+    results = eviz_obj.visualize_event_data(progress=progress, output_folder=staging_folder,
+                                            max_workers=settings.get('RENDER_WORKERS', RENDER_WORKERS),
+                                            profile=settings.get('RENDER_PROFILE', PREVIEW_PROFILE))
+    return result_cache.put(cache_key, results, staging_folder)
+
+def process_mat_upload(file_path, cache_key, settings):
+    """Render and cache the variables of a generic .mat upload, see process_event_upload."""
+    result_cache = _result_cache(settings)
+    staging_folder = result_cache.staging_folder(uuid.uuid4().hex)
+    results = process_mat_file(file_path, output_folder=staging_folder,
+                               max_workers=settings.get('RENDER_WORKERS', RENDER_WORKERS),
+                               profile=settings.get('RENDER_PROFILE', PREVIEW_PROFILE))
+    return result_cache.put(cache_key, results, staging_folder)
+
+def _export_file(output_path, job_id, write):
+    # write(path) into a private file first, so a half written export is never served
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    root, extension = os.path.splitext(output_path)
+    partial_path = f"{root}.{job_id or uuid.uuid4().hex}.partial{extension}"
+    try:
+        result = write(partial_path)
+        os.replace(partial_path, output_path)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+    return result
+
+def export_event_representations(file_path, store_folder, output_path, download_url, kind, window, params,
+                                 progress=None, job_id=None):
+    """
+    # stream an event upload into a compressed per-window representation file, see export_representations
+    :param store_folder: string - event store of the upload, see process_event_upload
+    :param output_path: string - .h5 or .npz file, only created once complete
+    :param download_url: string - url the finished file is served from
+    :param kind: string - 'frame', 'time_surface' or 'voxel_grid'
+    :param window: dict - {'time_window': seconds} or {'event_count': events}
+    :param params: dict - n_bins / tau
+    :return: results list for results.html
+    """
+    source = _event_source(file_path, store_folder)
+    with stage('export_representations', kind=kind):
+        n_windows = _export_file(output_path, job_id, lambda path: export_representations(source, path, kind,
+                                                                                          **window, **params))
+    return [{'variable': f'{kind} ({n_windows} windows)', 'file': download_url}]
+
+def export_event_playback(file_path, store_folder, output_path, download_url, time_window, params, progress=None,
+                          job_id=None):
+    """Stream an event upload into an MP4 / GIF playback, see export_playback and export_event_representations."""
+    source = _event_source(file_path, store_folder)
+    with stage('export_playback'):
+        n_frames = _export_file(output_path, job_id, lambda path: export_playback(source, path, time_window,
+                                                                                  **params))
+    return [{'variable': f'Event playback ({n_frames} frames)', 'file': download_url}]
@@ -2,25 +2,85 @@ import scipy.io
 import h5py
 import numpy as np
 import os
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import seaborn as sns
-from mpl_toolkits.mplot3d import Axes3D
 import scipy.sparse
 from scipy.io.matlab.mio5_params import mat_struct   # <-- Import mat_struct
-
-OUTPUT_FOLDER = 'static/images'
-os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+from scripts.render import PlotTask, render_results, load_seaborn, OUTPUT_FOLDER, RENDER_WORKERS, PREVIEW_PROFILE
+from scripts.stats_engine import compute_stats
+from scripts.rasterize import point_reader, rasterize_points, draw_grid
+from scripts.instrumentation import stage
 
 # Max dimension threshold for downsampling 2D arrays
 MAX_DIM = 200
-
-def save_plot(fig, filename):
-    filepath = os.path.join(OUTPUT_FOLDER, f"{filename}.png")
-    fig.savefig(filepath, dpi=300)
-    plt.close(fig)
-    return f"/{filepath}"
+# longest strided preview read from a v7.3 vector
+MAX_PREVIEW_POINTS = 100000
+
+def queue_plot(filename, draw, *args):
+    """Queue a figure drawn by draw(fig, *args); process_mat_file renders all of them in parallel."""
+    return PlotTask(filename, draw, args)
+
+def draw_complex_plot(fig, key, real_part, imag_part):
+    ax = fig.subplots()
+    ax.plot(real_part, label='Real Part')
+    ax.plot(imag_part, label='Imag Part', linestyle='dashed')
+    ax.set_title(f"{key} (Complex)")
+    ax.legend()
+
+def draw_bar_chart(fig, key, labels, vals):
+    ax = fig.subplots()
+    ax.bar(labels, vals, color='skyblue')
+    ax.set_title(f"{key} - Bar Chart (Categorical)")
+
+def draw_line_plot(fig, key, data, stats_str):
+    ax = fig.subplots()
+    ax.plot(data)
+    ax.set_title(f"{key} - 1D Plot")
+    ax.set_xlabel(stats_str)
+
+def draw_scatter_plot(fig, key, data):
+    if data.shape[1] == 2:
+        ax = fig.subplots()
+        ax.scatter(data[:, 0], data[:, 1], alpha=0.7)
+        ax.set_title(f"{key} - 2D Scatter")
+    else:
+        # registers the '3d' projection, only needed by the processes drawing one
+        from mpl_toolkits.mplot3d import Axes3D
+        ax = fig.add_subplot(111, projection='3d')
+        ax.scatter(data[:, 0], data[:, 1], data[:, 2], alpha=0.7)
+        ax.set_title(f"{key} - 3D Scatter")
+
+def draw_raster_plot(fig, key, raster):
+    # Nx2 -> points per cell, Nx3 -> points per (x, y) cell and the mean third column
+    axes = fig.subplots(1, 1 if raster['mean'] is None else 2, squeeze=False)[0]
+    image = draw_grid(axes[0], raster['counts'], raster['extent'], 'viridis', log=True)
+    axes[0].set_title(f"{key} - 2D Density ({raster['points']} points)")
+    fig.colorbar(image, ax=axes[0], label='points')
+    if raster['mean'] is not None:
+        image = draw_grid(axes[1], raster['mean'], raster['extent'], 'magma')
+        axes[1].set_title(f"{key} - mean of column 3")
+        fig.colorbar(image, ax=axes[1])
+    fig.tight_layout()
+
+def is_point_set(shape):
+    """Nx2 / Nx3 numeric variables are point sets, plotted as a scatter or, past MAX_DIM points, a raster."""
+    return len(shape) == 2 and shape[1] in (2, 3) and shape[0] > 1
+
+def analyze_point_set(key, data, stats):
+    """
+    # aggregate every point of a large Nx2 / Nx3 variable into a fixed-size grid, see rasterize_points
+    :param data: (N, k) numpy array or the (k, N) v7.3 dataset, read in chunks
+    :param stats: StreamingStats of the full variable
+    """
+    raster = rasterize_points(*point_reader(data))
+    plot_path = queue_plot(key, draw_raster_plot, key, raster)
+    stats = stats.summary()
+    stats['non_finite_points'] = raster['dropped']
+    return [{'variable': key, 'file': plot_path, 'stats': stats}]
+
+def draw_heatmap(fig, title, data):
+    ax = fig.subplots()
+    load_seaborn().heatmap(data, cmap='viridis', ax=ax)
+    if title:
+        ax.set_title(title)
 
 def analyze_mat_struct(key, data):
     """
@@ -41,30 +101,121 @@ def analyze_mat_struct(key, data):
     return results
 
 def get_basic_stats(arr):
-    """Compute mean, std, min, max for numeric arrays."""
-    return {
-        'mean': float(np.mean(arr)),
-        'std': float(np.std(arr)),
-        'min': float(np.min(arr)),
-        'max': float(np.max(arr))
-    }
-
-def analyze_and_plot(key, data):
+    """Compute mean, std, min, max (plus NaN count and quantiles) for numeric arrays in one chunked pass."""
+    return compute_stats(arr).summary()
+
+def read_h5_preview(dataset):
+    """
+    # strided read of a v7.3 dataset, small enough to plot, in MATLAB (column-major) orientation
+    vectors keep up to MAX_PREVIEW_POINTS samples, other arrays MAX_DIM per axis and 3D arrays their first 5 slices
+    """
+    long_axes = len([size for size in dataset.shape if size > 1])
+    limit = MAX_PREVIEW_POINTS if long_axes <= 1 else MAX_DIM
+    selection = [slice(None, None, max(1, -(-size // limit))) for size in dataset.shape]
+    if dataset.ndim == 3:
+        # MATLAB's first axis is stored last
+        selection[-1] = slice(0, 5)
+    return np.asarray(dataset[tuple(selection)]).T
+
+def analyze_h5_dataset(key, dataset):
+    """Summarize a v7.3 dataset from its metadata, chunked statistics and a strided preview."""
+    matlab_class = dataset.attrs.get('MATLAB_class', b'')
+    matlab_class = matlab_class.decode() if isinstance(matlab_class, bytes) else str(matlab_class)
+    shape = tuple(reversed(dataset.shape))
+
+    if 'MATLAB_empty' in dataset.attrs:
+        return [{'variable': key, 'file': '', 'value': f"{key} is an empty {matlab_class} array"}]
+    if matlab_class == 'char' and dataset.size <= MAX_PREVIEW_POINTS:
+        return [{'variable': key, 'file': '', 'value': ''.join(map(chr, np.asarray(dataset[()]).T.ravel()))}]
+    if h5py.check_dtype(ref=dataset.dtype) is not None or matlab_class == 'cell':
+        return [{'variable': key, 'file': '', 'value': f"{key} is an object/Cell array of shape {shape}"}]
+    if dataset.ndim >= 4:
+        return [{'variable': key, 'file': '',
+                 'value': f"{key} has {dataset.ndim} dimensions (shape={shape}). Handling advanced 4D+ is custom."}]
+
+    if is_point_set(shape) and shape[0] > MAX_DIM and dataset.dtype.kind in ['f', 'i', 'u']:
+        results = analyze_point_set(key, dataset, compute_stats(dataset))
+        results[0]['value'] = f"{key} shape={shape}, chunks={dataset.chunks}: all points rasterized"
+        return results
+
+    preview = read_h5_preview(dataset)
+    if preview.dtype.names and 'real' in preview.dtype.names:
+        # complex values are stored as a (real, imag) compound
+        return analyze_and_plot(key, preview['real'] + 1j * preview['imag'])
+    if preview.dtype.kind not in ['f', 'i', 'u'] or preview.size == dataset.size or np.squeeze(preview).ndim > 2:
+        return analyze_and_plot(key, preview)
+    # statistics and value counts always describe the whole dataset, not only the preview
+    results = analyze_and_plot(key, preview, compute_stats(dataset))
+    for result in results:
+        if 'stats' in result:
+            result['value'] = f"{key} shape={shape}, chunks={dataset.chunks}: strided preview of {preview.shape}"
+    return results
+
+def read_h5_sparse(group):
+    """Build a scipy CSC matrix from a v7.3 sparse group (data, ir row indices, jc column pointers), O(nnz)."""
+    jc = group['jc'][()]
+    ir = group['ir'][()] if 'ir' in group else np.zeros(0, dtype=np.uint64)
+    values = group['data'][()] if 'data' in group else np.ones(len(ir))
+    if values.dtype.names and 'real' in values.dtype.names:
+        values = values['real'] + 1j * values['imag']
+    return scipy.sparse.csc_matrix((values, ir, jc), shape=(int(group.attrs['MATLAB_sparse']), len(jc) - 1))
+
+def bin_sparse_nonzeros(matrix, max_dim=MAX_DIM):
+    """Count the nonzeros of a sparse matrix falling in each cell of an at most max_dim x max_dim grid."""
+    coo = matrix.tocoo()
+    rows, cols = matrix.shape
+    out_rows, out_cols = min(rows, max_dim), min(cols, max_dim)
+    row_bin = coo.row.astype(np.int64) * out_rows // rows
+    col_bin = coo.col.astype(np.int64) * out_cols // cols
+    return np.bincount(row_bin * out_cols + col_bin, minlength=out_rows * out_cols).reshape(out_rows, out_cols)
+
+def analyze_sparse(key, data):
+    """Plot and summarize a sparse matrix from its stored entries, never densifying a large one."""
+    rows, cols = data.shape
+    if np.iscomplexobj(data):
+        data = abs(data)
+    stats = compute_stats(data).summary()
+    stats['nnz'] = int(data.nnz)
+    stats['density'] = data.nnz / (rows * cols) if rows * cols else 0.0
+    summary = f"{key} is sparse {rows}x{cols}, nnz={data.nnz}, density={stats['density']:.3g}"
+    if rows <= MAX_DIM and cols <= MAX_DIM:
+        # small enough to show every value
+        plot_path = queue_plot(key, draw_heatmap, None, data.toarray())
+    else:
+        plot_path = queue_plot(key, draw_heatmap, f"{key} - nonzeros per cell", bin_sparse_nonzeros(data))
+    return [{'variable': key, 'file': plot_path, 'stats': stats, 'value': summary}]
+
+def analyze_and_plot(key, data, stats=None):
+    """
+    # summarize one variable and queue its plots
+    :param stats: optional StreamingStats of the full variable when data is only a preview of it
+    """
     results = []
 
     # 1. Handle MATLAB structs (mat_struct)
     if isinstance(data, mat_struct):
         results.extend(analyze_mat_struct(key, data))
 
-    # 2. Handle dict/h5py.Group
+    # 2. Handle dict/h5py.Group (v7.3 sparse matrices are stored as a group)
+    elif isinstance(data, h5py.Group) and data.attrs.get('MATLAB_class') in (b'sparse', 'sparse'):
+        results.extend(analyze_sparse(key, read_h5_sparse(data)))
+
     elif isinstance(data, dict) or isinstance(data, h5py.Group):
         results.append({'variable': key, 'file': '', 'value': f"{key} is a struct/dict, see subfields"})
         for subkey, value in data.items():
             results.extend(analyze_and_plot(f"{key}.{subkey}", value))
 
+    # 2b. v7.3 datasets are read lazily, never as a whole
+    elif isinstance(data, h5py.Dataset):
+        results.extend(analyze_h5_dataset(key, data))
+
     # 3. NumPy arrays
     elif isinstance(data, np.ndarray):
         data = np.squeeze(data)
+        if is_point_set(data.shape) and data.shape[0] > MAX_DIM and data.dtype.kind in ['f', 'i', 'u']:
+            # aggregated rather than strided, so no point is left out and any size can be drawn
+            results.extend(analyze_point_set(key, data, stats or compute_stats(data)))
+            return results
         if data.size > 1e6:
             # 4D check or skip if user wants
             # If > 1 million elements, skip or partial downsample
@@ -75,12 +226,7 @@ def analyze_and_plot(key, data):
         if np.iscomplexobj(data):
             real_part = np.real(data)
             imag_part = np.imag(data)
-            fig, ax = plt.subplots()
-            ax.plot(real_part, label='Real Part')
-            ax.plot(imag_part, label='Imag Part', linestyle='dashed')
-            ax.set_title(f"{key} (Complex)")
-            ax.legend()
-            plot_path = save_plot(fig, f"{key}_complex")
+            plot_path = queue_plot(f"{key}_complex", draw_complex_plot, key, real_part, imag_part)
             results.append({'variable': f"{key} (Complex)", 'file': plot_path})
             return results
 
@@ -91,26 +237,20 @@ def analyze_and_plot(key, data):
         # 1D -> numeric? Maybe bar chart or line plot
         elif data.ndim == 1:
             if hasattr(data, 'dtype') and data.dtype.kind in ['f', 'i', 'u']:
-                unique_vals = np.unique(data)
+                # moments and value counts come from the same single pass
+                stats = stats or compute_stats(data)
                 # If few unique values => bar chart
-                if len(unique_vals) < 20 and len(unique_vals) != len(data):
+                if stats.value_counts is not None and len(stats.value_counts) != stats.count:
                     # Possibly categorical
-                    fig, ax = plt.subplots()
-                    counts = [(val, np.sum(data == val)) for val in unique_vals]
-                    labels, vals = zip(*counts)
-                    ax.bar(labels, vals, color='skyblue')
-                    ax.set_title(f"{key} - Bar Chart (Categorical)")
-                    plot_path = save_plot(fig, f"{key}_bar")
+                    labels = sorted(stats.value_counts)
+                    vals = [stats.value_counts[val] for val in labels]
+                    plot_path = queue_plot(f"{key}_bar", draw_bar_chart, key, labels, vals)
                     results.append({'variable': key, 'file': plot_path})
                 else:
                     # Default to line plot
-                    fig, ax = plt.subplots()
-                    ax.plot(data)
-                    ax.set_title(f"{key} - 1D Plot")
-                    stats = get_basic_stats(data)
+                    stats = stats.summary()
                     stats_str = f"(mean={stats['mean']:.2f}, std={stats['std']:.2f}, min={stats['min']:.2f}, max={stats['max']:.2f})"
-                    ax.set_xlabel(stats_str)
-                    plot_path = save_plot(fig, key)
+                    plot_path = queue_plot(key, draw_line_plot, key, data, stats_str)
                     results.append({'variable': key, 'file': plot_path, 'stats': stats})
             elif data.dtype == object:
                 # Possibly a cell array or object array
@@ -140,6 +280,8 @@ def analyze_and_plot(key, data):
         # 2D -> Scatter vs Heatmap
         elif data.ndim == 2:
             if hasattr(data, 'dtype') and data.dtype.kind in ['f', 'i', 'u']:
+                # statistics describe the full array, not the downsampled one
+                stats = (stats or compute_stats(data)).summary()
                 # Downsample if too large
                 rows, cols = data.shape
                 if rows > MAX_DIM or cols > MAX_DIM:
@@ -148,27 +290,13 @@ def analyze_and_plot(key, data):
                     data = data[::row_factor, ::col_factor]
 
                 # If shape is Nx2 or Nx3 => Scatter
-                if (data.shape[1] == 2 or data.shape[1] == 3) and data.shape[0] > 1:
+                if is_point_set(data.shape):
                     # Scatter logic
-                    if data.shape[1] == 2:
-                        fig, ax = plt.subplots()
-                        ax.scatter(data[:, 0], data[:, 1], alpha=0.7)
-                        ax.set_title(f"{key} - 2D Scatter")
-                    else:
-                        fig = plt.figure()
-                        ax = fig.add_subplot(111, projection='3d')
-                        ax.scatter(data[:, 0], data[:, 1], data[:, 2], alpha=0.7)
-                        ax.set_title(f"{key} - 3D Scatter")
-                    stats = get_basic_stats(data)
-                    plot_path = save_plot(fig, key)
+                    plot_path = queue_plot(key, draw_scatter_plot, key, data)
                     results.append({'variable': key, 'file': plot_path, 'stats': stats})
                 else:
                     # Default Heatmap
-                    fig, ax = plt.subplots()
-                    sns.heatmap(data, cmap='viridis', ax=ax)
-                    ax.set_title(f"{key} - 2D Heatmap")
-                    stats = get_basic_stats(data)
-                    plot_path = save_plot(fig, key)
+                    plot_path = queue_plot(key, draw_heatmap, f"{key} - 2D Heatmap", data)
                     results.append({'variable': key, 'file': plot_path, 'stats': stats})
             elif data.dtype == object:
                 results.append({
@@ -197,9 +325,7 @@ def analyze_and_plot(key, data):
                         rf = max(1, srows // MAX_DIM)
                         cf = max(1, scols // MAX_DIM)
                         slice_data = slice_data[::rf, ::cf]
-                    fig, ax = plt.subplots()
-                    sns.heatmap(slice_data, cmap='viridis', ax=ax)
-                    plot_path = save_plot(fig, f"{key}_slice_{i}")
+                    plot_path = queue_plot(f"{key}_slice_{i}", draw_heatmap, None, slice_data)
                     results.append({'variable': f"{key} (slice {i})", 'file': plot_path})
             else:
                 results.append({
@@ -219,11 +345,7 @@ def analyze_and_plot(key, data):
 
     # 4. Sparse data
     elif scipy.sparse.issparse(data):
-        dense_data = data.toarray()
-        fig, ax = plt.subplots()
-        sns.heatmap(dense_data, cmap='viridis', ax=ax)
-        plot_path = save_plot(fig, key)
-        results.append({'variable': key, 'file': plot_path})
+        results.extend(analyze_sparse(key, data))
 
     # 5. Scalars
     elif isinstance(data, (int, float, bool)):
@@ -231,21 +353,30 @@ def analyze_and_plot(key, data):
 
     return results
 
-def process_mat_file(file_path):
-    try:
-        mat_data = scipy.io.loadmat(file_path, struct_as_record=False, squeeze_me=True)
-    except NotImplementedError:
-        mat_data = h5py.File(file_path, 'r')
-
+def analyze_mat_variables(mat_data):
     results = []
     for key in mat_data:
-        if key.startswith('__'):
+        # "#refs#" holds the targets of v7.3 cell references, not a variable
+        if key.startswith('__') or key.startswith('#'):
             continue
-        results.extend(analyze_and_plot(key, mat_data[key]))
+        with stage('analyze_and_plot', variable=key):
+            results.extend(analyze_and_plot(key, mat_data[key]))
+    return results
+
+def process_mat_file(file_path, max_workers=RENDER_WORKERS, output_folder=OUTPUT_FOLDER, profile=PREVIEW_PROFILE):
+    if h5py.is_hdf5(file_path):
+        # v7.3 files are HDF5, only what the plots need is read and the file is closed before rendering
+        with h5py.File(file_path, 'r') as mat_data:
+            results = analyze_mat_variables(mat_data)
+    else:
+        with stage('loadmat'):
+            mat_data = scipy.io.loadmat(file_path, struct_as_record=False, squeeze_me=True)
+        results = analyze_mat_variables(mat_data)
 
     if not results:
         results.append({'variable': 'No valid data found', 'file': ''})
-    return results
+    # every queued figure is rendered here, in parallel, keeping the results order
+    return render_results(results, output_folder, max_workers, profile=profile)
 
 
 
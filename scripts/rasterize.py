@@ -0,0 +1,80 @@
+import h5py
+import numpy as np
+
+# grid cells per axis of a rasterized point set
+RASTER_BINS = 512
+# points binned at a time, bounds the memory of out-of-core inputs
+RASTER_CHUNK_POINTS = 1 << 20
+
+def point_reader(data):
+    """
+    # (read(start, stop) -> float64 (m, k) block, n_points) over an (N, k) point array
+    h5py datasets hold MATLAB (N, k) variables transposed as (k, N) and are read block by block
+    """
+    if isinstance(data, h5py.Dataset):
+        return (lambda start, stop: np.asarray(data[:, start:stop], dtype=np.float64).T), data.shape[1]
+    data = np.asarray(data)
+    return (lambda start, stop: np.asarray(data[start:stop], dtype=np.float64)), data.shape[0]
+
+def _iter_finite_blocks(read, n_points, chunk_points):
+    for start in range(0, n_points, chunk_points):
+        block = read(start, min(start + chunk_points, n_points))
+        finite = np.isfinite(block).all(axis=1)
+        yield block if finite.all() else block[finite], len(block) - int(finite.sum())
+
+def rasterize_points(read, n_points, bins=RASTER_BINS, chunk_points=RASTER_CHUNK_POINTS):
+    """
+    # aggregate a point set into fixed-size grids, two chunked passes (extent, then np.bincount binning)
+    :param read: callable(start, stop) -> (m, k) block of points, k = 2 or 3, see point_reader
+    :param n_points: int - number of points
+    :param bins: int - grid cells per axis
+    :return: dict - 'counts' (bins, bins) points per (x, y) cell, 'mean' (bins, bins) mean third coordinate per
+             cell (NaN where empty, None for 2D points), 'extent' (x_min, x_max, y_min, y_max), 'points' binned
+             and 'dropped' points with a NaN / inf coordinate
+    """
+    low, high, dropped, n_columns = None, None, 0, None
+    for block, n_dropped in _iter_finite_blocks(read, n_points, chunk_points):
+        dropped += n_dropped
+        n_columns = block.shape[1]
+        if len(block):
+            low = block.min(axis=0) if low is None else np.minimum(low, block.min(axis=0))
+            high = block.max(axis=0) if high is None else np.maximum(high, block.max(axis=0))
+    counts = np.zeros(bins * bins, dtype=np.int64)
+    sums = np.zeros(bins * bins) if n_columns == 3 else None
+    if low is None:
+        return {'counts': counts.reshape(bins, bins), 'mean': None if sums is None else sums.reshape(bins, bins),
+                'extent': (0.0, 1.0, 0.0, 1.0), 'points': 0, 'dropped': dropped}
+
+    # a constant coordinate still gets a non-empty axis
+    span = np.where(high[:2] > low[:2], high[:2] - low[:2], 1.0)
+    for block, _ in _iter_finite_blocks(read, n_points, chunk_points):
+        cell = np.minimum(((block[:, :2] - low[:2]) / span * bins).astype(np.int64), bins - 1)
+        index = cell[:, 0] * bins + cell[:, 1]
+        counts += np.bincount(index, minlength=bins * bins)
+        if sums is not None:
+            sums += np.bincount(index, weights=block[:, 2], minlength=bins * bins)
+    mean = None
+    if sums is not None:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = (sums / counts).reshape(bins, bins)
+    extent = (float(low[0]), float(low[0] + span[0]), float(low[1]), float(low[1] + span[1]))
+    return {'counts': counts.reshape(bins, bins), 'mean': mean, 'extent': extent,
+            'points': int(counts.sum()), 'dropped': dropped}
+
+def draw_grid(ax, grid, extent, cmap, log=False):
+    """
+    # draw an aggregated (x, y) grid as one image, whatever the number of points behind it
+    :param grid: 2D array indexed [x, y]
+    :param extent: tuple - (x_min, x_max, y_min, y_max) of the grid
+    :param log: bool - logarithmic colours for counts, empty cells are left blank
+    :return: the AxesImage, for a colorbar
+    """
+    from matplotlib.colors import LogNorm
+    image = np.asarray(grid, dtype=np.float64).T
+    norm = None
+    if log:
+        image = np.where(image > 0, image, np.nan)
+        if np.isfinite(image).any():
+            norm = LogNorm(vmin=np.nanmin(image), vmax=max(np.nanmax(image), np.nanmin(image) + 1))
+    return ax.imshow(image, origin='lower', extent=extent, aspect='auto', cmap=cmap, norm=norm,
+                     interpolation='nearest')
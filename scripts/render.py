@@ -0,0 +1,133 @@
+import io
+import os
+import atexit
+import functools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from scripts.instrumentation import stage
+
+# default folder for rendered images, served by Flask as /static/images
+OUTPUT_FOLDER = 'static/images'
+# resolution of full quality exports
+PLOT_DPI = 300
+# output settings per rendering profile; the results page shows the fast preview, the others are exported on demand
+RENDER_PROFILES = {
+    'preview': {'format': 'webp', 'dpi': 100},
+    'png': {'format': 'png', 'dpi': PLOT_DPI},
+    'svg': {'format': 'svg', 'dpi': PLOT_DPI},
+    'pdf': {'format': 'pdf', 'dpi': PLOT_DPI},
+}
+PREVIEW_PROFILE = 'preview'
+# worker processes used to render figures, None uses one per CPU
+RENDER_WORKERS = None
+
+# run warm_up in every new render worker before it takes a figure
+WARM_UP_WORKERS = True
+
+# one lazily created pool per worker count, reused across requests
+_executors = {}
+
+class PlotTask:
+    def __init__(self, filename, draw, args, figsize=None):
+        """
+        # deferred figure: draw(fig, *args) is run on a fresh Figure and saved as filename.png
+        :param filename: string - image name, the output folder is chosen when rendering
+        :param draw: module level function taking (fig, *args), so the task can be sent to a worker process
+        :param args: tuple - plot data handed to draw
+        :param figsize: tuple - figure size in inches, None for the matplotlib default
+        """
+        self.filename = filename
+        self.draw = draw
+        self.args = args
+        self.figsize = figsize
+
+def new_figure(figsize=None):
+    """Fresh Figure on an Agg canvas; matplotlib is only imported by the processes that actually draw."""
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    return fig
+
+@functools.lru_cache(maxsize=None)
+def load_seaborn():
+    """Import seaborn (with pandas and scipy.stats, the bulk of the startup cost) on first use, Agg backend only."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import seaborn
+    return seaborn
+
+def warm_up():
+    """
+    # pay the one-off plotting costs (imports, font cache, backend and image writer setup) up front
+    renders a throwaway figure in memory, used as the initializer of worker processes and by preload hooks
+    """
+    with stage('warm_up'):
+        import numpy as np
+        fig = new_figure(figsize=(2, 2))
+        ax = fig.subplots()
+        load_seaborn().heatmap(np.eye(2), ax=ax)
+        ax.set_title('warm up')
+        fig.savefig(io.BytesIO(), format=RENDER_PROFILES[PREVIEW_PROFILE]['format'],
+                    dpi=RENDER_PROFILES[PREVIEW_PROFILE]['dpi'])
+
+def render_plot(task, filepath, profile=PREVIEW_PROFILE):
+    """Draw one PlotTask with the object oriented Agg API (no pyplot global state) and save it in a RENDER_PROFILES format."""
+    settings = RENDER_PROFILES[profile]
+    with stage('draw', plot=task.filename):
+        fig = new_figure(task.figsize)
+        task.draw(fig, *task.args)
+    with stage('savefig', plot=task.filename):
+        fig.savefig(filepath, dpi=settings['dpi'], format=settings['format'])
+    return f"/{filepath}"
+
+def _output_path(output_folder, task, profile):
+    return os.path.join(output_folder, f"{task.filename}.{RENDER_PROFILES[profile]['format']}").replace(os.sep, '/')
+
+def _get_executor(max_workers):
+    if max_workers not in _executors:
+        _executors[max_workers] = ProcessPoolExecutor(max_workers=max_workers,
+                                                      initializer=warm_up if WARM_UP_WORKERS else None)
+    return _executors[max_workers]
+
+def shutdown_executors():
+    """Stop the shared render pools, registered with atexit so the interpreter does not wait on idle workers."""
+    while _executors:
+        _, executor = _executors.popitem()
+        executor.shutdown(wait=True, cancel_futures=True)
+
+atexit.register(shutdown_executors)
+
+def render_results(results, output_folder=OUTPUT_FOLDER, max_workers=RENDER_WORKERS, progress=None,
+                   profile=PREVIEW_PROFILE):
+    """
+    # render every PlotTask found in results[i]['file'] and replace it with the saved image url
+    :param results: list of result dicts, updated in place, ordering is kept
+    :param output_folder: string - folder the images are written to
+    :param max_workers: int - worker processes, 1 renders in this process (use 1 inside job workers,
+                        which already run in parallel); draw / savefig stage timings are only
+                        collected for figures rendered in this process
+    :param progress: optional callable(done, total, current) called as figures finish
+    :param profile: string - RENDER_PROFILES key, the cheap preview unless a full quality export is asked for
+    :return: results
+    """
+    if profile not in RENDER_PROFILES:
+        raise ValueError(f"Unknown render profile: {profile}")
+    pending = [result for result in results if isinstance(result.get('file'), PlotTask)]
+    os.makedirs(output_folder, exist_ok=True)
+    if max_workers == 1 or len(pending) <= 1:
+        for done, result in enumerate(pending, start=1):
+            result['file'] = render_plot(result['file'], _output_path(output_folder, result['file'], profile), profile)
+            if progress is not None:
+                progress(done, len(pending), result['variable'])
+        return results
+
+    executor = _get_executor(max_workers)
+    futures = {executor.submit(render_plot, result['file'], _output_path(output_folder, result['file'], profile),
+                               profile): result
+               for result in pending}
+    for done, future in enumerate(as_completed(futures), start=1):
+        result = futures[future]
+        result['file'] = future.result()
+        if progress is not None:
+            progress(done, len(pending), result['variable'])
+    return results
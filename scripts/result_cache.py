@@ -0,0 +1,170 @@
+import os
+import json
+import time
+import shutil
+import logging
+import hashlib
+import threading
+from scripts.render import OUTPUT_FOLDER
+from scripts.instrumentation import log_event
+from scripts.atomic_io import write_json_atomic
+
+# every upload renders into its own content-derived sub-folder of the served image folder
+RESULT_CACHE_FOLDER = OUTPUT_FOLDER
+# results lists live outside static/ so they are never served directly
+RESULT_INDEX_FOLDER = 'cache/results'
+# total bytes kept under the image folder before the least recently used entries are evicted
+DEFAULT_CACHE_MAX_BYTES = 1 << 30
+# staging folders of renders without a known job are removed after this many seconds
+STALE_ENTRY_SECONDS = 3600
+# seconds between two runs of the background reaper
+REAPER_INTERVAL_SECONDS = 300
+STAGING_PREFIX = '.staging-'
+
+def hash_file(file_path, block_size=1 << 20):
+    """Return the sha256 hex digest of a file, read block by block."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def is_entry_name(name):
+    """True for the sha256 hex folder names of cache entries, anything else in the image folder is left alone."""
+    return len(name) == 64 and all(c in '0123456789abcdef' for c in name)
+
+def _disk_usage(path):
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+class ResultCache:
+    def __init__(self, cache_folder=RESULT_CACHE_FOLDER, max_bytes=DEFAULT_CACHE_MAX_BYTES,
+                 index_folder=RESULT_INDEX_FOLDER, is_active=None):
+        """
+        # on-disk cache of rendered results, keyed on upload content + rendering parameters
+        :param cache_folder: string - served image folder, one sub-folder per cache entry
+        :param max_bytes: int - size budget for everything under cache_folder
+        :param index_folder: string - private folder holding the results list of every entry
+        :param is_active: optional callable(token) -> True / False / None (unknown) telling
+                          whether the render owning a staging folder is still running
+        """
+        self.cache_folder = cache_folder
+        self.max_bytes = max_bytes
+        self.index_folder = index_folder
+        self.is_active = is_active
+        self._reaper = None
+        os.makedirs(cache_folder, exist_ok=True)
+        os.makedirs(index_folder, exist_ok=True)
+
+    def make_key(self, content_hash, params):
+        """Combine the upload hash with the rendering parameters into one entry key."""
+        payload = json.dumps({'content': content_hash, 'params': params}, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def entry_folder(self, key):
+        """Folder holding the images of a published entry; its urls never change content."""
+        return os.path.join(self.cache_folder, key).replace(os.sep, '/')
+
+    def staging_folder(self, token):
+        """Private folder a render writes into before put() publishes it under its key."""
+        folder = os.path.join(self.cache_folder, f"{STAGING_PREFIX}{token}").replace(os.sep, '/')
+        os.makedirs(folder, exist_ok=True)
+        return folder
+
+    def get(self, key):
+        """Return the cached results list for key, or None on a miss."""
+        index_path = os.path.join(self.index_folder, f"{key}.json")
+        try:
+            with open(index_path) as f:
+                results = json.load(f)
+            # the index file mtime doubles as the LRU timestamp
+            os.utime(index_path)
+        except (OSError, ValueError):
+            # missing, or evicted while we were reading it
+            return None
+        if not os.path.isdir(self.entry_folder(key)):
+            return None
+        return results
+
+    def put(self, key, results, staging_folder):
+        """
+        # publish a finished render: rename its staging folder to the entry folder and store the results
+        :return: the results list with image urls pointing at the entry folder
+        """
+        entry_folder = self.entry_folder(key)
+        try:
+            os.rename(staging_folder, entry_folder)
+        except OSError:
+            # a concurrent render of the same key was published first, its images are identical
+            shutil.rmtree(staging_folder, ignore_errors=True)
+
+        staging_url, entry_url = f"/{staging_folder}/", f"/{entry_folder}/"
+        results = [dict(result, file=result['file'].replace(staging_url, entry_url)) if result.get('file') else result
+                   for result in results]
+
+        write_json_atomic(os.path.join(self.index_folder, f"{key}.json"), results)
+
+        self.evict()
+        return results
+
+    def _staging_abandoned(self, name, path):
+        active = self.is_active(name[len(STAGING_PREFIX):]) if self.is_active is not None else None
+        if active is None:
+            return time.time() - os.path.getmtime(path) > STALE_ENTRY_SECONDS
+        return not active
+
+    def evict(self):
+        """
+        # remove abandoned staging folders, then least recently used entries until the folder fits in max_bytes
+        only entry and staging folders are considered, other files (e.g. the tracked sample images) are kept
+        """
+        items = []
+        total_bytes = 0
+        for name in os.listdir(self.cache_folder):
+            path = os.path.join(self.cache_folder, name)
+            try:
+                if name.startswith(STAGING_PREFIX):
+                    if self._staging_abandoned(name, path):
+                        shutil.rmtree(path, ignore_errors=True)
+                    else:
+                        # still rendering, counts towards the budget but is never evicted
+                        total_bytes += _disk_usage(path)
+                    continue
+                if not is_entry_name(name) or not os.path.isdir(path):
+                    continue
+                index_path = os.path.join(self.index_folder, f"{name}.json")
+                last_used = os.path.getmtime(index_path if os.path.exists(index_path) else path)
+                item_bytes = _disk_usage(path)
+            except OSError:
+                # removed by a concurrent eviction
+                continue
+            total_bytes += item_bytes
+            items.append((last_used, item_bytes, name, path))
+
+        for _, item_bytes, name, path in sorted(items):
+            if total_bytes <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            try:
+                os.remove(os.path.join(self.index_folder, f"{name}.json"))
+            except OSError:
+                # removed by a concurrent eviction
+                pass
+            total_bytes -= item_bytes
+
+    def start_reaper(self, interval=REAPER_INTERVAL_SECONDS):
+        """Run evict() every interval seconds in a daemon thread, bounding disk use between uploads."""
+        if self._reaper is not None:
+            return
+
+        def reap():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.evict()
+                except OSError as e:
+                    log_event('cache_reaper_failed', logging.ERROR, error=str(e))
+
+        self._reaper = threading.Thread(target=reap, name='result-cache-reaper', daemon=True)
+        self._reaper.start()
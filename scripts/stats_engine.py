@@ -0,0 +1,150 @@
+import h5py
+import numpy as np
+import scipy.sparse
+
+# elements per block while scanning in-memory arrays and h5py datasets
+STATS_CHUNK_ELEMENTS = 1 << 22
+# distinct values tracked before value counts are given up (analyze_and_plot draws a bar chart below 20)
+MAX_TRACKED_VALUES = 19
+# samples kept by the quantile sketch
+QUANTILE_SKETCH_SIZE = 4096
+# quantiles reported by StreamingStats.summary
+REPORTED_QUANTILES = (0.01, 0.25, 0.5, 0.75, 0.99)
+
+def iter_blocks(data, chunk_elements=STATS_CHUNK_ELEMENTS):
+    """Yield an array or h5py dataset as consecutive blocks along its longest axis, aligned to h5py chunks."""
+    if data.shape == ():
+        yield np.asarray(data[()])
+        return
+    axis = int(np.argmax(data.shape))
+    step = max(1, chunk_elements // max(1, data.size // max(data.shape[axis], 1)))
+    chunks = getattr(data, 'chunks', None)
+    if chunks is not None:
+        step = max(chunks[axis], step // chunks[axis] * chunks[axis])
+    selection = [slice(None)] * len(data.shape)
+    for start in range(0, data.shape[axis], step):
+        selection[axis] = slice(start, start + step)
+        yield data[tuple(selection)]
+
+class StreamingStats:
+    def __init__(self, seed=0):
+        """
+        # one pass, mergeable summary: moments (Chan / Welford), extrema, NaN count, value counts, quantile sketch
+        :param seed: int - seed of the sketch sampler, so summaries are reproducible
+        """
+        self.count = 0
+        self.nan_count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+        # None once more than MAX_TRACKED_VALUES distinct values were seen
+        self.value_counts = {}
+        # uniform sample of the values seen so far, each sample stands for count / len(sample) values
+        self.sample = np.empty(0)
+        self._rng = np.random.default_rng(seed)
+
+    def update(self, block):
+        """Add every value of an array block, NaNs are only counted."""
+        values = np.asarray(block).ravel()
+        if values.dtype.kind == 'f':
+            nan_mask = np.isnan(values)
+            if nan_mask.any():
+                self.nan_count += int(nan_mask.sum())
+                values = values[~nan_mask]
+        if not values.size:
+            return
+        if self.value_counts is not None:
+            # a cheap look at the head of the block skips the full sort for continuous data
+            if len(np.unique(values[:4 * MAX_TRACKED_VALUES])) > MAX_TRACKED_VALUES:
+                self.value_counts = None
+            else:
+                unique, counts = np.unique(values, return_counts=True)
+                self._merge_value_counts(dict(zip(unique.tolist(), counts.tolist())))
+        values = values.astype(np.float64, copy=False)
+        block_mean = values.mean()
+        self._merge(values.size, block_mean, float(np.sum((values - block_mean) ** 2)), values.min(), values.max(),
+                    self._draw(values, QUANTILE_SKETCH_SIZE))
+
+    def update_constant(self, value, count):
+        """Add count copies of one value, e.g. the implicit zeros of a sparse matrix, in O(1)."""
+        if count <= 0:
+            return
+        if self.value_counts is not None:
+            self._merge_value_counts({value: count})
+        self._merge(count, float(value), 0.0, value, value, np.full(min(count, QUANTILE_SKETCH_SIZE), float(value)))
+
+    def merge(self, other):
+        """Fold a StreamingStats built over other chunks (or in another worker) into this one."""
+        self.nan_count += other.nan_count
+        if not other.count:
+            return
+        if self.value_counts is not None:
+            if other.value_counts is None:
+                self.value_counts = None
+            else:
+                self._merge_value_counts(other.value_counts)
+        self._merge(other.count, other.mean, other.m2, other.min, other.max, other.sample)
+
+    def _merge_value_counts(self, counts):
+        for value, count in counts.items():
+            self.value_counts[value] = self.value_counts.get(value, 0) + count
+        if len(self.value_counts) > MAX_TRACKED_VALUES:
+            self.value_counts = None
+
+    def _merge(self, count, mean, m2, data_min, data_max, sample):
+        total = self.count + count
+        delta = mean - self.mean
+        # keep each side's share of the sketch proportional to the values it stands for
+        keep = min(QUANTILE_SKETCH_SIZE, len(self.sample) + len(sample))
+        from_self = self._rng.binomial(keep, self.count / total)
+        from_self = min(from_self, len(self.sample))
+        self.sample = np.concatenate([self._draw(self.sample, from_self), self._draw(sample, keep - from_self)])
+        self.mean += delta * count / total
+        self.m2 += m2 + delta ** 2 * self.count * count / total
+        self.min = min(self.min, float(data_min))
+        self.max = max(self.max, float(data_max))
+        self.count = total
+
+    def _draw(self, values, size):
+        if size >= len(values):
+            return np.asarray(values, dtype=np.float64)
+        return self._rng.choice(np.asarray(values, dtype=np.float64), size, replace=False)
+
+    def quantiles(self, qs=REPORTED_QUANTILES):
+        """Approximate quantiles from the sketch, exact while at most QUANTILE_SKETCH_SIZE values were seen."""
+        if not self.count:
+            return {q: float('nan') for q in qs}
+        return {q: float(value) for q, value in zip(qs, np.quantile(self.sample, qs))}
+
+    def summary(self):
+        """Plain dict for the results page: mean / std / min / max as get_basic_stats, plus the extra counters."""
+        return {
+            'mean': float(self.mean) if self.count else float('nan'),
+            'std': float(np.sqrt(self.m2 / self.count)) if self.count else float('nan'),
+            'min': float(self.min) if self.count else float('nan'),
+            'max': float(self.max) if self.count else float('nan'),
+            'count': int(self.count),
+            'nan_count': int(self.nan_count),
+            'quantiles': {str(q): value for q, value in self.quantiles().items()},
+        }
+
+def compute_stats(data, chunk_elements=STATS_CHUNK_ELEMENTS):
+    """
+    # StreamingStats of a numpy array, h5py dataset or scipy sparse matrix, in one chunked pass
+    :param data: array-like - sparse matrices are summarized from their stored values plus the implicit zeros
+    :param chunk_elements: int - elements read per block
+    """
+    stats = StreamingStats()
+    if scipy.sparse.issparse(data):
+        # csr sums duplicate coo entries, so every stored value is one matrix cell
+        stored = data.tocsr()
+        for block in iter_blocks(stored.data, chunk_elements):
+            stats.update(block)
+        stats.update_constant(0, data.shape[0] * data.shape[1] - stored.nnz)
+        return stats
+    if not isinstance(data, h5py.Dataset):
+        data = np.asarray(data)
+    for block in iter_blocks(data, chunk_elements):
+        stats.update(block)
+    return stats
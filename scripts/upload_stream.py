@@ -0,0 +1,107 @@
+import os
+import hashlib
+import tempfile
+from flask import Request, current_app
+from werkzeug.exceptions import BadRequest
+
+# accepted uploads
+UPLOAD_EXTENSIONS = ('.mat', '.h5')
+# every HDF5 file (and so every MATLAB v7.3 file) carries this signature at offset 0 or after a 512 byte user block
+HDF5_SIGNATURE = b'\x89HDF\r\n\x1a\n'
+HDF5_SIGNATURE_OFFSETS = (0, 512)
+MAT_V5_MAGIC = b'MATLAB 5.0 MAT-file'
+# bytes needed to tell the formats apart
+SNIFF_BYTES = 512 + len(HDF5_SIGNATURE)
+
+class UploadRejected(BadRequest):
+    """Upload refused while it was still streaming in (wrong extension or file signature)."""
+
+def sniff_upload(head, file_name):
+    """
+    # check the first bytes of an upload against its extension
+    :param head: bytes - at least SNIFF_BYTES bytes, or the whole file when it is shorter
+    :param file_name: string - name sent by the client
+    :raises UploadRejected: when the content is not an HDF5 / MATLAB file of that extension
+    """
+    is_hdf5 = any(head[offset:offset + len(HDF5_SIGNATURE)] == HDF5_SIGNATURE for offset in HDF5_SIGNATURE_OFFSETS)
+    if file_name.endswith('.h5') and not is_hdf5:
+        raise UploadRejected(f"{file_name} is not an HDF5 file")
+    # v7.3 files are HDF5 behind a MATLAB text header, v5 files start with their own header
+    if file_name.endswith('.mat') and not (is_hdf5 or head.startswith(MAT_V5_MAGIC)):
+        raise UploadRejected(f"{file_name} is not a MATLAB v5 or v7.3 file")
+
+class HashingUploadFile:
+    def __init__(self, folder, file_name):
+        """
+        # upload sink: bytes go straight to a temporary file in folder while being hashed and sniffed
+        :param folder: string - folder of the temporary file, on the same filesystem as the final upload
+        :param file_name: string - name sent by the client, its extension selects the expected signature
+        """
+        if not file_name.endswith(UPLOAD_EXTENSIONS):
+            raise UploadRejected('Invalid file type. Please upload a .mat or .h5 file')
+        self.file_name = file_name
+        fd, self.path = tempfile.mkstemp(prefix='.upload-', dir=folder)
+        self._file = os.fdopen(fd, 'w+b')
+        self._digest = hashlib.sha256()
+        self._head = b''
+        self.size = 0
+        # set by claim() once the file was moved to its final place, close() deletes unclaimed files
+        self._claimed = False
+
+    def write(self, data):
+        if len(self._head) < SNIFF_BYTES:
+            self._head += bytes(data[:SNIFF_BYTES - len(self._head)])
+            if len(self._head) == SNIFF_BYTES:
+                self._sniff()
+        self._digest.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def _sniff(self):
+        try:
+            sniff_upload(self._head, self.file_name)
+        except UploadRejected:
+            self.close()
+            raise
+
+    def hexdigest(self):
+        """sha256 of everything written, the upload's storage key; files too short to sniff are checked here."""
+        if len(self._head) < SNIFF_BYTES:
+            self._sniff()
+        return self._digest.hexdigest()
+
+    def claim(self, file_path):
+        """Move the finished upload to file_path, keeping an existing copy of the same content."""
+        self._file.close()
+        if os.path.exists(file_path):
+            os.remove(self.path)
+        else:
+            os.replace(self.path, file_path)
+        self._claimed = True
+
+    # werkzeug reads the part back through these after parsing
+    def seek(self, *args):
+        return self._file.seek(*args)
+
+    def tell(self):
+        return self._file.tell()
+
+    def read(self, *args):
+        return self._file.read(*args)
+
+    def readline(self, *args):
+        return self._file.readline(*args)
+
+    def flush(self):
+        return self._file.flush()
+
+    def close(self):
+        self._file.close()
+        if not self._claimed and os.path.exists(self.path):
+            os.remove(self.path)
+
+class StreamingUploadRequest(Request):
+    """Flask request class writing uploaded files through HashingUploadFile instead of spooling them first."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return HashingUploadFile(current_app.config['UPLOAD_FOLDER'], filename or '')
@@ -0,0 +1,140 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import numpy as np
+import scipy
+import matplotlib
+
+# run as "python -m testfile_simulator.benchmark" or "python testfile_simulator/benchmark.py" from the repo root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scripts import instrumentation
+from scripts.instrumentation import collect_stages, stage, peak_rss_bytes
+from scripts.EBVisualizer import EVizTool, load_event_file
+from scripts.event_stream import stream_event_file
+from scripts.process_mat import process_mat_file
+from scripts.event_representations import export_representations
+from testfile_simulator.event_generator import write_h5_events, write_td_mat, write_generic_mat
+
+DEFAULT_SIZES = (10 ** 4, 10 ** 5, 10 ** 6)
+# scipy.io.savemat builds the whole file in memory, larger TD recordings are written as v7.3
+MAT_V5_MAX_EVENTS = 10 ** 7
+# larger recordings are only benchmarked through the streaming path
+IN_MEMORY_MAX_EVENTS = 10 ** 7
+# generic MAT variables are capped, process_mat keeps whole v5 files in memory
+GENERIC_MAT_MAX_ELEMENTS = 10 ** 7
+# time window (seconds) of the default time surface export checked on every TD .mat file
+CHECK_TIME_WINDOW = 1.0
+
+def environment():
+    """Versions and host details stored with every run, so results are only compared like for like."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'scipy': scipy.__version__,
+        'matplotlib': matplotlib.__version__,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+    }
+
+def run_case(benchmark, file_format, size, func, *args):
+    """Run one pipeline end to end and return its stage records and totals."""
+    with collect_stages() as stages:
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        func(*args)
+        wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+    result = {'benchmark': benchmark, 'format': file_format, 'size': size, 'wall_seconds': wall,
+              'cpu_seconds': cpu, 'peak_rss_bytes': peak_rss_bytes(), 'stages': stages}
+    print(f"{benchmark:<16} {file_format:<8} {size:>12} {wall:8.2f}s")
+    return result
+
+def in_memory_events(file_path, output_folder):
+    with stage('load_event_file'):
+        event_name, event_data, sensor_dim = load_event_file(file_path)
+        eviz_obj = EVizTool(event_name, event_data, sensor_dim)
+    eviz_obj.visualize_event_data(max_workers=1, output_folder=output_folder)
+
+def streamed_events(file_path, output_folder):
+    with stage('stream_event_file'):
+        eviz_obj = stream_event_file(file_path)
+    eviz_obj.visualize_event_data(max_workers=1, output_folder=output_folder)
+
+def check_time_surface(file_path, workdir):
+    """Export a time surface with the default tau and fail when it is blank, e.g. seconds applied as raw ticks."""
+    output_path = os.path.join(workdir, 'time_surface_check.npz')
+    export_representations(file_path, output_path, 'time_surface', time_window=CHECK_TIME_WINDOW)
+    with np.load(output_path) as export:
+        peak = float(export['representations'].max()) if export['representations'].size else 0.0
+    os.remove(output_path)
+    if peak < 0.5:
+        raise RuntimeError(f"{file_path}: time surface export is blank (max {peak:.3g})")
+
+def benchmark_size(size, workdir, seed, hot_pixels):
+    results = []
+    image_folder = os.path.join(workdir, 'images')
+    mat_version = '5' if size <= MAT_V5_MAX_EVENTS else '7.3'
+    files = {
+        'h5': os.path.join(workdir, f'events_{size}.h5'),
+        f'mat_v{mat_version}': os.path.join(workdir, f'events_{size}_td.mat'),
+    }
+    # the same seed gives the same events in both formats
+    write_h5_events(files['h5'], size, hot_pixels=hot_pixels, seed=seed)
+    write_td_mat(files[f'mat_v{mat_version}'], size, version=mat_version, sensor_size=(128, 128),
+                 hot_pixels=hot_pixels, seed=seed)
+
+    for file_format, file_path in files.items():
+        # v7.3 files are always streamed by the app
+        if size <= IN_MEMORY_MAX_EVENTS and file_format != 'mat_v7.3':
+            results.append(run_case('events_memory', file_format, size, in_memory_events, file_path, image_folder))
+        results.append(run_case('events_stream', file_format, size, streamed_events, file_path, image_folder))
+        if file_format.startswith('mat'):
+            check_time_surface(file_path, workdir)
+        os.remove(file_path)
+
+    n_elements = min(size, GENERIC_MAT_MAX_ELEMENTS)
+    generic_path = os.path.join(workdir, f'generic_{n_elements}.mat')
+    write_generic_mat(generic_path, n_elements, seed=seed)
+    results.append(run_case('generic_mat', 'mat_v5', n_elements, process_mat_file, generic_path, 1, image_folder))
+    os.remove(generic_path)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Time every pipeline stage on synthetic recordings of growing size.")
+    parser.add_argument('--sizes', type=float, nargs='+', default=DEFAULT_SIZES,
+                        help="event counts to benchmark, e.g. 1e4 1e6 1e8")
+    parser.add_argument('--output', default='benchmark_results.json', help="machine readable results file")
+    parser.add_argument('--workdir', default=None, help="folder for generated files, a temporary one by default")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--hot-pixels', type=int, default=10)
+    args = parser.parse_args()
+
+    # one JSON log line per stage would drown the summary
+    instrumentation.LOG_STAGES = False
+    workdir = args.workdir or tempfile.mkdtemp(prefix='matvisualizer-benchmark-')
+    os.makedirs(workdir, exist_ok=True)
+    try:
+        results = []
+        for size in args.sizes:
+            results.extend(benchmark_size(int(size), workdir, args.seed, args.hot_pixels))
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(args.output, 'w') as f:
+        json.dump({'environment': environment(), 'seed': args.seed, 'results': results}, f, indent=1)
+    print(f"Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import numpy as np
+import scipy.io as sio
+import scipy.sparse
+import h5py
+
+# events generated (and written) per block, bounds memory for 10^8 event files
+GENERATOR_CHUNK_SIZE = 1 << 21
+# MATLAB 7.3 files are HDF5 files behind a 512 byte MATLAB header
+MAT_V73_HEADER = b'MATLAB 7.3 MAT-file, Platform: GLNXA64, Created by: event_generator'
+
+def generate_event_chunks(n_events, sensor_size=(128, 128), on_ratio=0.5, hot_pixels=0, hot_pixel_fraction=0.1,
+                          duration_us=10_000_000, chunk_size=GENERATOR_CHUNK_SIZE, seed=0):
+    """
+    # DAVIS-style synthetic event stream, yielded as time ordered column chunks
+    :param n_events: int - total number of events
+    :param sensor_size: tuple - (x_max, y_max), coordinates are 0-based
+    :param on_ratio: float - probability of an ON (p = 1) event
+    :param hot_pixels: int - number of pixels firing far more often than the rest
+    :param hot_pixel_fraction: float - share of all events coming from the hot pixels
+    :param duration_us: int - recording length in microseconds
+    :param chunk_size: int - events per yielded chunk
+    :param seed: int - same seed, same events
+    :return: generator of {'t', 'x', 'y', 'p'} dicts (int64 us, uint16, uint16, int8 0 / 1)
+    """
+    rng = np.random.default_rng(seed)
+    hot_x = rng.integers(0, sensor_size[0], hot_pixels)
+    hot_y = rng.integers(0, sensor_size[1], hot_pixels)
+    n_chunks = max(1, -(-n_events // chunk_size))
+    for index in range(n_chunks):
+        n = min(chunk_size, n_events - index * chunk_size)
+        # every chunk covers its own slice of the recording, so the stream stays sorted across chunks
+        t_start = duration_us * index // n_chunks
+        t_stop = max(duration_us * (index + 1) // n_chunks, t_start + 1)
+        t = np.sort(rng.integers(t_start, t_stop, n))
+        x = rng.integers(0, sensor_size[0], n)
+        y = rng.integers(0, sensor_size[1], n)
+        if hot_pixels:
+            hot = np.flatnonzero(rng.random(n) < hot_pixel_fraction)
+            pixel = rng.integers(0, hot_pixels, len(hot))
+            x[hot], y[hot] = hot_x[pixel], hot_y[pixel]
+        p = (rng.random(n) < on_ratio).astype(np.int8)
+        yield {'t': t.astype(np.int64), 'x': x.astype(np.uint16), 'y': y.astype(np.uint16), 'p': p}
+
+def write_h5_events(filename, n_events, **kwargs):
+    """Write an .h5 recording with an (N, 4) uint32 t / x / y / p "events" dataset, like the simulator output."""
+    with h5py.File(filename, 'w') as f:
+        events = f.create_dataset('events', (n_events, 4), dtype=np.uint32, chunks=(min(max(n_events, 1), 1 << 16), 4))
+        start = 0
+        for chunk in generate_event_chunks(n_events, **kwargs):
+            stop = start + len(chunk['t'])
+            events[start:stop] = np.column_stack([chunk['t'], chunk['x'], chunk['y'], chunk['p']])
+            start = stop
+    print(f"'{filename}' created with {n_events} events")
+
+def _write_mat_v73_header(filename):
+    with open(filename, 'r+b') as f:
+        # 116 bytes of text, 8 bytes of subsystem offset, version 0x0200 and the "IM" endian marker
+        f.write(MAT_V73_HEADER.ljust(116, b' ') + b'\x00' * 8 + b'\x00\x02' + b'IM')
+
+def write_td_mat(filename, n_events, sensor_size=(240, 180), version='5', **kwargs):
+    """
+    # write a DAVIS "TD" struct .mat recording: 1-based x / y, p in {-1, 1}, ts in microseconds, plus xMax / yMax
+    :param version: '5' (scipy.io.savemat, built in memory) or '7.3' (HDF5, written chunk by chunk)
+    """
+    chunks = generate_event_chunks(n_events, sensor_size=sensor_size, **kwargs)
+    fields = {'ts': np.float64, 'x': np.uint16, 'y': np.uint16, 'p': np.int16}
+
+    def mat_columns(chunk):
+        return {'ts': chunk['t'].astype(np.float64), 'x': chunk['x'] + 1, 'y': chunk['y'] + 1,
+                'p': np.where(chunk['p'] > 0, 1, -1).astype(np.int16)}
+
+    if version == '5':
+        columns = [mat_columns(chunk) for chunk in chunks]
+        td = {name: np.concatenate([c[name] for c in columns]).astype(dtype).reshape(-1, 1)
+              for name, dtype in fields.items()}
+        sio.savemat(filename, {'TD': td, 'xMax': float(sensor_size[0]), 'yMax': float(sensor_size[1])})
+    elif version == '7.3':
+        with h5py.File(filename, 'w', userblock_size=512) as f:
+            td = f.create_group('TD')
+            td.attrs['MATLAB_class'] = np.bytes_('struct')
+            # MATLAB column vectors (N, 1) are stored transposed as (1, N)
+            datasets = {name: td.create_dataset(name, (1, n_events), dtype=dtype,
+                                                chunks=(1, min(max(n_events, 1), 1 << 16)))
+                        for name, dtype in fields.items()}
+            for name, dtype in fields.items():
+                datasets[name].attrs['MATLAB_class'] = np.bytes_({np.float64: 'double', np.uint16: 'uint16',
+                                                                  np.int16: 'int16'}[dtype])
+            start = 0
+            for chunk in chunks:
+                columns = mat_columns(chunk)
+                stop = start + len(chunk['t'])
+                for name in fields:
+                    datasets[name][0, start:stop] = columns[name]
+                start = stop
+            for name, size in (('xMax', sensor_size[0]), ('yMax', sensor_size[1])):
+                f.create_dataset(name, data=np.array([[float(size)]])).attrs['MATLAB_class'] = np.bytes_('double')
+        _write_mat_v73_header(filename)
+    else:
+        raise ValueError(f"Unsupported MAT version: {version}")
+    print(f"'{filename}' created with {n_events} events (MAT v{version})")
+
+def write_generic_mat(filename, n_elements, seed=0):
+    """Write a generic .mat file whose 1D / 2D / 3D / sparse / struct variables each hold about n_elements values."""
+    rng = np.random.default_rng(seed)
+    side = max(2, int(np.sqrt(n_elements)))
+    depth = max(2, int(round(n_elements ** (1.0 / 3))))
+    mat_dict = {
+        'signal_1d': np.cumsum(rng.standard_normal(n_elements)),
+        'labels_1d': rng.integers(0, 5, n_elements).astype(np.float64),
+        'image_2d': rng.random((side, side)),
+        'points_nx3': rng.standard_normal((max(2, n_elements // 3), 3)),
+        'volume_3d': rng.random((depth, depth, depth)),
+        # about n_elements nonzeros spread over a 100x larger matrix
+        'sparse_2d': scipy.sparse.random(side * 10, side * 10, density=min(1.0, n_elements / (side * 10) ** 2),
+                                         format='csc', random_state=seed),
+        'struct_data': {
+            'time': np.arange(n_elements, dtype=np.float64),
+            'nested': {'matrix': rng.random((side, side))},
+        },
+    }
+    sio.savemat(filename, mat_dict)
+    print(f"'{filename}' created with variables of about {n_elements} elements")
+
+if __name__ == "__main__":
+    write_h5_events("synthetic_events.h5", 1_000_000, hot_pixels=10)
+    write_td_mat("synthetic_events_td.mat", 1_000_000, hot_pixels=10)
+    write_generic_mat("synthetic_generic.mat", 1_000_000)